@@ -1,16 +1,36 @@
-from flask import Flask, request, Response, stream_with_context, render_template_string
-import requests
+"""
+Serverless entry point for Vercel.
+
+Cold starts run this module, so importing it only sets up what every
+invocation needs. Both the landing page and proxied requests are handled by
+plain WSGI functions; Flask is never imported. The landing page is served from
+the prebuilt api/landing.html (see build_landing.py), and requests is imported
+the first time a request is actually proxied. A pooled requests session with a
+DNS cache and a small response cache are kept at module level, so a warm
+container reuses them across invocations.
+"""
+
 import logging
-import urllib.parse
-import time
 import os
-from http.client import HTTPResponse
-import json
+import threading
+import time
+from urllib.parse import parse_qs
 
-# Import the HTML template from your main file
-from proxy import HTML_TEMPLATE
+from build_landing import LANDING_PATH, YEAR_PLACEHOLDER, render_landing
+from cache import ResponseCache, cacheable_request, freshness
 
-app = Flask(__name__)
+TAGLINE = '<p class="tagline">Neural network infiltration system :: Bypass-level ALPHA</p>'
+
+# Resolved addresses are reused for this long in a warm container
+DNS_TTL = 60
+DNS_CACHE_SIZE = 256
+
+# Methods the proxy forwards
+METHODS = ('GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS')
+
+# Response headers that only apply to one connection
+HOP_BY_HOP = ('connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+              'te', 'trailer', 'trailers', 'transfer-encoding', 'upgrade')
 
 # Set up logging
 logging.basicConfig(
@@ -19,77 +39,223 @@ logging.basicConfig(
 )
 logger = logging.getLogger('web_proxy')
 
-@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'])
-@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'])
-def handler(path):
+# Filtering policy: a compiled rules file shipped with the deployment
+policy = None
+if os.environ.get('CYBERSPLICER_POLICY'):
+    from policy import PolicyEngine
+    policy = PolicyEngine(
+        os.environ['CYBERSPLICER_POLICY'],
+        mode=os.environ.get('CYBERSPLICER_POLICY_MODE', 'enforce')
+    )
+
+# Small shared responses (explicit max-age, no cookies) for warm invocations
+response_cache = ResponseCache(max_entries=128, max_bytes=4 * 1024 * 1024, max_ttl=120)
+
+# Warm state, created on first use
+_landing = None
+_session = None
+_init_lock = threading.Lock()
+
+
+def landing_page(message=None):
+    """
+    The landing page HTML, optionally with the tagline replaced by a message
+    """
+    global _landing
+    if _landing is None:
+        try:
+            with open(LANDING_PATH, encoding='utf-8') as f:
+                _landing = f.read()
+        except OSError:
+            # No prebuilt asset: render the template from proxy.py instead
+            _landing = render_landing()
+    page = _landing.replace(YEAR_PLACEHOLDER, time.strftime("%Y"))
+    if message is not None:
+        import html
+        page = page.replace(TAGLINE, f'<p class="tagline" style="color: #e74c3c;">{html.escape(message)}</p>')
+    return page
+
+
+def upstream_session():
+    """
+    The pooled requests session, created (with the DNS cache) on first use
+    """
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                import http.cookiejar
+                import requests
+                from dnscache import DNSCache, DNSCachingAdapter
+
+                session = requests.Session()
+                adapter = DNSCachingAdapter(DNSCache(DNS_TTL, DNS_CACHE_SIZE), pool_connections=16, pool_maxsize=16)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                # Never keep upstream cookies: the session is shared by every client
+                session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+                _session = session
+    return _session
+
+
+def request_headers(environ):
+    """
+    Client request headers to forward upstream, from the WSGI environ
+    """
+    headers = {}
+    for key, value in environ.items():
+        if key.startswith('HTTP_') and key != 'HTTP_HOST':
+            headers[key[5:].replace('_', '-').title()] = value
+    if environ.get('CONTENT_TYPE'):
+        headers['Content-Type'] = environ['CONTENT_TYPE']
+    return headers
+
+
+def request_body(environ):
+    """
+    The client's request body
+    """
+    try:
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    return environ['wsgi.input'].read(length) if length > 0 else b''
+
+
+def html_response(start_response, status, page):
     """
-    Serverless handler function for Vercel
+    Send an HTML page
     """
+    body = page.encode('utf-8')
+    start_response(status, [
+        ('Content-Type', 'text/html; charset=utf-8'),
+        ('Content-Length', str(len(body)))
+    ])
+    return [body]
+
+
+def proxy_request(environ, start_response):
+    """
+    Forward one ?url= request upstream and stream the response back
+    """
+    import requests
+    import urllib.parse
+
+    method = environ.get('REQUEST_METHOD', 'GET')
+    if method not in METHODS:
+        start_response('405 Method Not Allowed', [('Allow', ', '.join(METHODS)), ('Content-Length', '0')])
+        return []
+
     # Get the URL to forward to
-    target_url = request.args.get('url')
-    
-    if not target_url:
-        # If no URL provided, show the beautiful interface
-        return render_template_string(HTML_TEMPLATE, current_year=time.strftime("%Y"))
-    
+    args = parse_qs(environ.get('QUERY_STRING', ''), keep_blank_values=True)
+    target_url = args['url'][0]
+    path = environ.get('PATH_INFO', '').lstrip('/')
+
     # Make sure the URL has a scheme
     if not target_url.startswith(('http://', 'https://')):
         target_url = 'https://' + target_url
-    
+
     # Get the full URL including the path
     if path:
         parsed_url = urllib.parse.urlparse(target_url)
         target_url = f"{parsed_url.scheme}://{parsed_url.netloc}/{path}"
-    
+
+    # Check the target against the filtering policy
+    if policy is not None:
+        rule = policy.match(target_url)
+        if rule is not None:
+            logger.info(f"Policy {policy.mode}: {target_url} matches {rule}")
+            if policy.enforcing:
+                return html_response(start_response, '403 Forbidden', landing_page(f"Blocked by policy: {rule}"))
+
     # Log the request
     logger.info(f"Proxying request to: {target_url}")
-    
+
     # Copy the request headers
-    headers = {key: value for key, value in request.headers.items() if key.lower() not in ['host', 'content-length']}
-    
+    headers = request_headers(environ)
+    client_accept_encoding = headers.get('Accept-Encoding', '')
+    # Only ask for encodings the client accepts: requests would otherwise add
+    # gzip, and the body is forwarded undecoded
+    headers.setdefault('Accept-Encoding', 'identity')
+    params = {k: v[0] for k, v in args.items() if k != 'url'}
+
+    # Serve small shared responses from the warm cache
+    cache_key = None
+    if cacheable_request(method, headers):
+        cache_key = (target_url, tuple(sorted(params.items())), client_accept_encoding)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            start_response(cached.status, cached.headers)
+            return [cached.body]
+
     try:
         # Forward the request to the target server
-        resp = requests.request(
-            method=request.method,
+        resp = upstream_session().request(
+            method=method,
             url=target_url,
             headers=headers,
-            data=request.get_data(),
-            cookies=request.cookies,
-            params={k: v for k, v in request.args.items() if k != 'url'},
+            data=request_body(environ),
+            params=params,
             allow_redirects=False,
             stream=True,
             verify=True
         )
-        
-        # Create a response object
-        response_headers = {key: value for key, value in resp.headers.items() if key.lower() not in ['transfer-encoding']}
-        
-        # Function to rewrite links in HTML content
-        def generate():
-            for chunk in resp.iter_content(chunk_size=4096):
-                yield chunk
-        
-        # Return the response
-        return Response(
-            stream_with_context(generate()),
-            status=resp.status_code,
-            headers=response_headers,
-            content_type=resp.headers.get('content-type', 'text/html')
-        )
-    
     except requests.exceptions.RequestException as e:
         logger.error(f"Error proxying request: {e}")
-        
+
         # Return error page with the beautiful interface
-        error_html = render_template_string(
-            HTML_TEMPLATE.replace(
-                '<p class="tagline">Neural network infiltration system :: Bypass-level ALPHA</p>',
-                f'<p class="tagline" style="color: #e74c3c;">Error: {e}</p>'
-            ),
-            current_year=time.strftime("%Y")
-        )
-        return error_html, 500
+        return html_response(start_response, '500 Internal Server Error', landing_page(f"Error: {e}"))
+
+    # Create a response object
+    status = f"{resp.status_code} {resp.reason}"
+    # Repeated headers such as Set-Cookie stay separate lines
+    response_headers = [(key, value) for key, value in resp.raw.headers.items() if key.lower() not in HOP_BY_HOP]
+    if 'Content-Type' not in resp.headers:
+        response_headers.append(('Content-Type', 'text/html'))
+
+    # Keep a copy of small cacheable responses
+    length = resp.headers.get('Content-Length', '')
+    if (cache_key is not None and resp.status_code == 200 and length.isdigit()
+            and int(length) <= response_cache.max_entry_bytes):
+        ttl = freshness(resp.headers, response_cache.max_ttl)
+        if ttl:
+            try:
+                body = resp.raw.read(decode_content=False)
+            finally:
+                resp.close()
+            response_cache.put(cache_key, status, response_headers, body, ttl)
+            start_response(status, response_headers)
+            return [body]
+
+    start_response(status, response_headers)
+
+    def generate():
+        # Forward the body exactly as sent, so Content-Length,
+        # Content-Encoding and 206 Content-Range stay valid
+        try:
+            for chunk in resp.raw.stream(4096, decode_content=False):
+                yield chunk
+        finally:
+            resp.close()
+
+    return generate()
+
+
+def app(environ, start_response):
+    """
+    WSGI entry point: the landing page, or a proxied ?url= request
+    """
+    if not parse_qs(environ.get('QUERY_STRING', '')).get('url'):
+        body = landing_page().encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'text/html; charset=utf-8'),
+            ('Content-Length', str(len(body)))
+        ])
+        return [] if environ.get('REQUEST_METHOD') == 'HEAD' else [body]
+    return proxy_request(environ, start_response)
+
 
 # For local development
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
\ No newline at end of file
+    from werkzeug.serving import run_simple
+    run_simple("0.0.0.0", int(os.environ.get("PORT", 8080)), app, use_reloader=True, use_debugger=True, threaded=True)
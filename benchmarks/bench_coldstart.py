@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Cold-start benchmark for the serverless entry point (api/index.py).
+
+Each run starts a fresh interpreter and measures importing the module, serving
+the first landing page, and a cold start whose first request is proxied
+(import plus one ?url= request to a local origin, including the lazy
+imports and session setup it triggers):
+
+    python benchmarks/bench_coldstart.py --runs 10
+    python benchmarks/bench_coldstart.py --importtime   # slowest imports
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = r'''
+import io, json, sys, time
+sys.path[:0] = [ROOT, ROOT + '/api']
+
+def environ(query):
+    return {'REQUEST_METHOD': 'GET', 'QUERY_STRING': query, 'PATH_INFO': '/', 'SCRIPT_NAME': '',
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr,
+            'wsgi.version': (1, 0), 'wsgi.multithread': False, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False}
+
+t0 = time.perf_counter()
+import index
+t1 = time.perf_counter()
+b''.join(index.app(environ(''), lambda *a: None))
+t2 = time.perf_counter()
+b''.join(index.app(environ('url=' + ORIGIN), lambda *a: None))
+t3 = time.perf_counter()
+print(json.dumps({'import': t1 - t0, 'landing': t2 - t1, 'first_proxy': t3 - t2,
+                  'proxy_cold_start': (t1 - t0) + (t3 - t2), 'modules': len(sys.modules)}))
+'''
+
+
+class Origin(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body = b'hello'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def run_once(origin):
+    """
+    Timings from one fresh interpreter
+    """
+    code = f"ROOT = {ROOT!r}\nORIGIN = {origin!r}\n" + PROBE
+    out = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(out.stdout)
+
+
+def importtime(limit):
+    """
+    Print the slowest imports (cumulative) when importing the entry point
+    """
+    code = f"import sys; sys.path[:0] = [{ROOT!r}, {ROOT + '/api'!r}]; import index"
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                         check=True, capture_output=True, text=True)
+    rows = []
+    for line in out.stderr.splitlines()[1:]:
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace(':', '|', 1).split('|')]
+        rows.append((int(cumulative_us), int(self_us), name))
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:limit]:
+        print(f"{cumulative_us / 1000:8.1f} ms {self_us / 1000:8.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serverless cold-start benchmark')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true', help='Show the slowest imports instead')
+    args = parser.parse_args()
+
+    if args.importtime:
+        importtime(20)
+        return
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    origin = f"http://127.0.0.1:{server.server_port}/"
+    try:
+        runs = [run_once(origin) for _ in range(args.runs)]
+    finally:
+        server.shutdown()
+    for key in ('import', 'landing', 'first_proxy', 'proxy_cold_start'):
+        values = [run[key] * 1000 for run in runs]
+        print(f"{key:<16} median {statistics.median(values):7.1f} ms   max {max(values):7.1f} ms")
+    print(f"modules loaded after first proxied request: {runs[-1]['modules']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the policy engine: build time, file size, lookup latency for
+blocked and allowed URLs and resident memory after lookups (mapped rules
+pages plus the per-worker host cache, which is not shared between workers).
+
+    python benchmarks/bench_policy.py --rules 2000000
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from policy import HOST_CACHE_SIZE, PolicyEngine, build  # noqa: E402
+
+TLDS = ['com', 'net', 'org', 'io', 'co.uk', 'de', 'ru', 'info']
+
+
+def random_domain(rng):
+    """
+    A random two- or three-label domain name
+    """
+    name = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') for _ in range(rng.randint(6, 14)))
+    if rng.random() < 0.3:
+        name = f"cdn{rng.randint(0, 99)}.{name}"
+    return f"{name}.{rng.choice(TLDS)}"
+
+
+def rss():
+    """
+    Resident set size of this process in bytes
+    """
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def time_lookups(engine, urls, repeat=5):
+    """
+    Mean nanoseconds per engine.match() call, best of `repeat` passes
+    """
+    match = engine.match
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for url in urls:
+            match(url)
+        elapsed = (time.perf_counter_ns() - start) / len(urls)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Policy engine benchmark')
+    parser.add_argument('--rules', type=int, default=1000000, help='Number of domain rules')
+    parser.add_argument('--lookups', type=int, default=200000, help='Lookups per measurement')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'blocklist.txt')
+        output = os.path.join(tmp, 'rules.bin')
+
+        blocked = []
+        with open(source, 'w') as f:
+            for i in range(args.rules):
+                domain = random_domain(rng)
+                f.write(f"0.0.0.0 {domain}\n")
+                if i < args.lookups:
+                    blocked.append(f"https://www.{domain}/index.html")
+
+        start = time.perf_counter()
+        n_domains, n_prefixes, _rejected = build([source], output)
+        build_seconds = time.perf_counter() - start
+
+        allowed = [f"https://{random_domain(rng)}/a/b/c" for _ in range(args.lookups)]
+        hot = [rng.choice(blocked[:1000] + allowed[:1000]) for _ in range(args.lookups)]
+        rss_before = rss()
+        start = time.perf_counter()
+        engine = PolicyEngine(output, check_interval=3600)
+        load_us = (time.perf_counter() - start) * 1e6
+
+        size = os.path.getsize(output)
+
+        print(f"rules:              {n_domains + n_prefixes}")
+        print(f"build time:         {build_seconds:.2f} s")
+        print(f"load time:          {load_us:.1f} us")
+        print(f"file size:          {size / 1e6:.2f} MB ({size / (n_domains + n_prefixes):.1f} B/rule)")
+        print(f"lookup (blocked):   {time_lookups(engine, blocked, repeat=1):.0f} ns (cold host)")
+        print(f"lookup (allowed):   {time_lookups(engine, allowed, repeat=1):.0f} ns (cold host)")
+
+        # Real traffic revisits a small working set of hosts
+        print(f"lookup (hot hosts): {time_lookups(engine, hot):.0f} ns")
+
+        # Fill the host cache to its limit to report its worst case
+        engine._table.host_cache.clear()
+        for i in range(HOST_CACHE_SIZE):
+            engine.match(allowed[i % len(allowed)].replace('https://', f'https://h{i}.', 1))
+        print(f"host cache:         {engine.host_cache_bytes / 1e6:.2f} MB when full "
+              f"({HOST_CACHE_SIZE} hosts, per worker, not shared)")
+        print(f"RSS growth:         {(rss() - rss_before) / 1e6:.2f} MB after lookups "
+              f"(touched rules pages + host cache)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark for parallel segmented fetching against a local origin that
+throttles every connection, standing in for a distant server.
+
+    python benchmarks/bench_segmented.py --size-mb 32 --rate-mb 4
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests  # noqa: E402
+
+from segmented import SegmentedFetch, can_segment  # noqa: E402
+
+CHUNK = 16 * 1024
+
+
+def make_origin(body, rate):
+    """
+    Request handler serving `body` with Range support at `rate` bytes/s per connection
+    """
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+    class Origin(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            start, end = 0, len(body) - 1
+            match = re.fullmatch(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+            if match and self.headers.get('If-Range', etag) == etag:
+                start, end = int(match.group(1)), min(int(match.group(2)), len(body) - 1)
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {start}-{end}/{len(body)}')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.end_headers()
+
+            pos = start
+            began = time.monotonic()
+            try:
+                while pos <= end:
+                    n = min(CHUNK, end - pos + 1)
+                    self.wfile.write(body[pos:pos + n])
+                    pos += n
+                    ahead = (pos - start) / rate - (time.monotonic() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    return Origin
+
+
+def timed(label, size, fetch):
+    """
+    Run one download and print its throughput
+    """
+    start = time.perf_counter()
+    digest = hashlib.sha1()
+    for chunk in fetch():
+        digest.update(chunk)
+    seconds = time.perf_counter() - start
+    print(f"{label:<22} {seconds:6.2f} s  {size / seconds / 1e6:7.2f} MB/s")
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segmented fetch benchmark')
+    parser.add_argument('--size-mb', type=float, default=32, help='Download size')
+    parser.add_argument('--rate-mb', type=float, default=4, help='Origin throughput per connection, MB/s')
+    parser.add_argument('--segment-mb', type=float, default=2, help='Range request size')
+    parser.add_argument('--connections', type=int, nargs='+', default=[2, 4, 8])
+    args = parser.parse_args()
+
+    body = os.urandom(int(args.size_mb * 1e6))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_origin(body, args.rate_mb * 1e6))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/file.bin'
+    expected = hashlib.sha1(body).hexdigest()
+
+    def sequential():
+        resp = requests.get(url, stream=True)
+        return resp.raw.stream(64 * 1024, decode_content=False)
+
+    assert timed('sequential', len(body), sequential) == expected
+
+    for connections in args.connections:
+        def parallel():
+            resp = requests.get(url, stream=True)
+            assert can_segment('GET', {}, resp, 0)
+            return SegmentedFetch(url, resp, connections=connections,
+                                  segment_size=int(args.segment_mb * 1e6))
+
+        assert timed(f'{connections} connections', len(body), parallel) == expected
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Prebuild the landing page served by the serverless entry point.
+
+api/index.py serves api/landing.html as a static asset so that a cold start
+neither imports proxy.py nor compiles the Jinja template. Re-run this script
+whenever HTML_TEMPLATE in proxy.py changes:
+
+    python build_landing.py
+"""
+
+import os
+
+# Left in the page and filled in per request
+YEAR_PLACEHOLDER = '{{ current_year }}'
+
+LANDING_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api', 'landing.html')
+
+
+def render_landing():
+    """
+    Render HTML_TEMPLATE with the year left as a placeholder
+    """
+    import jinja2
+    from proxy import HTML_TEMPLATE
+
+    return jinja2.Template(HTML_TEMPLATE).render(current_year=YEAR_PLACEHOLDER)
+
+
+def main():
+    with open(LANDING_PATH, 'w', encoding='utf-8') as f:
+        f.write(render_landing())
+    print(f"Wrote {LANDING_PATH}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Small in-memory cache of complete upstream responses.
+
+Entries are whole (status, headers, body) responses kept for a short time, in
+LRU order, with limits on both the number of entries and the total body bytes.
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CachedResponse = namedtuple('CachedResponse', 'status headers body expires')
+
+# Request headers that make a response specific to one client
+PRIVATE_REQUEST_HEADERS = ('cookie', 'authorization', 'range')
+
+
+def cacheable_request(method, headers):
+    """
+    Whether a request's response may be shared through the cache
+    """
+    return method == 'GET' and not any(key.lower() in PRIVATE_REQUEST_HEADERS for key in headers)
+
+
+def freshness(headers, max_ttl):
+    """
+    Seconds a response may be cached for, from its Cache-Control, capped at max_ttl
+
+    Returns 0 for responses that must not be shared: no explicit lifetime,
+    no-store / no-cache / private, Set-Cookie, or a Vary on anything but
+    Accept-Encoding.
+    """
+    if 'Set-Cookie' in headers:
+        return 0
+    vary = {v.strip().lower() for v in headers.get('Vary', '').split(',') if v.strip()}
+    if vary - {'accept-encoding'}:
+        return 0
+
+    ttl = 0
+    for directive in headers.get('Cache-Control', '').lower().split(','):
+        name, _, value = directive.strip().partition('=')
+        if name in ('no-store', 'no-cache', 'private'):
+            return 0
+        if name in ('max-age', 's-maxage'):
+            try:
+                ttl = max(ttl, int(value.strip('"')))
+            except ValueError:
+                return 0
+    return min(ttl, max_ttl)
+
+
+class ResponseCache:
+    """
+    Bounded, thread-safe TTL + LRU cache of small responses
+    """
+
+    def __init__(self, max_entries=256, max_bytes=8 * 1024 * 1024,
+                 max_entry_bytes=256 * 1024, max_ttl=300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_ttl = max_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        entry = self._entries.get(key)
+        return entry is not None and entry.expires > time.monotonic()
+
+    @property
+    def size_bytes(self):
+        return self._bytes
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+        return entry
+
+    def get(self, key):
+        """
+        Return the fresh CachedResponse for a key, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, status, headers, body, ttl):
+        """
+        Store a response for ttl seconds, evicting the least recently used
+        """
+        ttl = min(ttl, self.max_ttl)
+        if ttl <= 0 or len(body) > self.max_entry_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = CachedResponse(status, headers, body, time.monotonic() + ttl)
+            self._bytes += len(body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        return True
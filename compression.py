@@ -0,0 +1,191 @@
+"""
+On-the-fly compression of uncompressed upstream responses.
+
+compress_response() looks at the client's Accept-Encoding and the upstream
+headers and takes the first chunk of the body, so time to first byte does not
+wait for more of a slow origin. If the body is big enough, not already encoded
+and actually compressible, it returns a gzip (or Brotli, when the optional
+`brotli` package is installed) stream with matching headers. The compressor is
+flushed after every upstream chunk, so a page or event stream reaches the
+client as fast as the origin produces it. The compression level drops as the
+machine's load average rises, so a busy proxy spends less CPU per byte.
+"""
+
+import functools
+import itertools
+import os
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this are not worth compressing
+MIN_SIZE = 1024
+
+# Most bytes of the first chunk test-compressed to decide whether the body compresses
+SAMPLE_SIZE = 16 * 1024
+
+# Skip bodies whose sample does not shrink below this fraction at level 1
+MAX_RATIO = 0.9
+
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript', 'text/csv',
+    'application/json', 'application/javascript', 'application/x-javascript',
+    'application/xml', 'application/xhtml+xml', 'application/rss+xml',
+    'application/atom+xml', 'application/manifest+json', 'image/svg+xml',
+)
+
+# (load per CPU below which the level applies, gzip level, brotli quality)
+LEVELS = ((0.5, 6, 5), (1.0, 4, 3), (float('inf'), 1, 1))
+
+# How often the load average is re-read
+LOAD_CHECK_SECONDS = 1.0
+
+_load = {'checked': 0.0, 'per_cpu': 0.0}
+
+
+def load_per_cpu():
+    """
+    1-minute load average divided by the CPU count, re-read at most once a second
+    """
+    now = time.monotonic()
+    if now - _load['checked'] >= LOAD_CHECK_SECONDS:
+        _load['checked'] = now
+        try:
+            _load['per_cpu'] = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            # No load average on this platform: assume a moderately busy host
+            _load['per_cpu'] = 0.75
+    return _load['per_cpu']
+
+
+def compression_level(encoding):
+    """
+    Level for an encoding ('gzip' or 'br') given the current load
+    """
+    load = load_per_cpu()
+    for limit, gzip_level, brotli_quality in LEVELS:
+        if load < limit:
+            return brotli_quality if encoding == 'br' else gzip_level
+
+
+def choose_encoding(accept_encoding):
+    """
+    Best encoding we can produce that the client accepts, or None
+    """
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().lower().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip()] = q
+
+    wildcard = accepted.get('*', 0.0)
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.get(encoding, wildcard) > 0:
+            return encoding
+    return None
+
+
+def _header(headers, name):
+    """
+    Case-insensitive header lookup in a plain dict
+    """
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def should_compress(method, status, headers):
+    """
+    Whether an upstream response is a candidate, judging by its headers alone
+    """
+    if method == 'HEAD' or status != 200:
+        return False
+    if _header(headers, 'Content-Encoding') not in (None, 'identity'):
+        return False
+    if 'no-transform' in (_header(headers, 'Cache-Control') or '').lower():
+        return False
+    content_type = (_header(headers, 'Content-Type') or '').split(';', 1)[0].strip().lower()
+    if content_type not in COMPRESSIBLE_TYPES:
+        return False
+    length = _header(headers, 'Content-Length')
+    return not (length and length.isdigit() and int(length) < MIN_SIZE)
+
+
+def _compressed(encoding, level, chunks):
+    """
+    Compress a stream of chunks incrementally, flushing after each one
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level, mode=brotli.MODE_TEXT)
+        compress, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+        flush = functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # Emit everything for this chunk now instead of when the body ends
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    data = finish()
+    if data:
+        yield data
+
+
+def compress_response(method, status, headers, accept_encoding, chunks):
+    """
+    Wrap a response body in gzip/Brotli when it is worth it
+
+    Returns (chunks, headers): either the originals (with the first chunk
+    put back) or a compressed stream with Content-Length removed,
+    Content-Encoding set, Vary extended and any ETag weakened.
+    """
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None or not should_compress(method, status, headers):
+        return chunks, headers
+
+    # Judge compressibility from the first chunk only; reading further would
+    # hold back the response headers on a slow origin
+    chunks = iter(chunks)
+    sample = next(chunks, b'')
+    if not sample:
+        return chunks, headers
+    chunks = itertools.chain([sample], chunks)
+    sample = sample[:SAMPLE_SIZE]
+    if len(sample) >= MIN_SIZE and len(zlib.compress(sample, 1)) > MAX_RATIO * len(sample):
+        return chunks, headers
+
+    new_headers = {
+        key: value for key, value in headers.items()
+        if key.lower() not in ('content-length', 'content-encoding', 'vary', 'etag')
+    }
+    new_headers['Content-Encoding'] = encoding
+    vary = _header(headers, 'Vary')
+    if vary is None:
+        new_headers['Vary'] = 'Accept-Encoding'
+    elif vary.strip() == '*' or 'accept-encoding' in vary.lower():
+        new_headers['Vary'] = vary
+    else:
+        new_headers['Vary'] = f"{vary}, Accept-Encoding"
+    etag = _header(headers, 'ETag')
+    if etag:
+        # The compressed bytes differ, so only a weak validator still holds
+        new_headers['ETag'] = etag if etag.startswith('W/') else 'W/' + etag
+
+    return _compressed(encoding, compression_level(encoding), chunks), new_headers
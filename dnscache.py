@@ -0,0 +1,96 @@
+"""
+Short-lived DNS cache for upstream connections.
+
+DNSCachingAdapter is a requests transport adapter whose connection pools
+resolve host names through a DNSCache instead of calling getaddrinfo() for
+every new connection. Only connections opened by that adapter use the cache;
+the rest of the process resolves names as usual.
+"""
+
+import socket
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+
+class DNSCache:
+    """
+    getaddrinfo() results for TCP connections, kept for `ttl` seconds
+    """
+
+    def __init__(self, ttl=60, max_entries=256, resolver=socket.getaddrinfo):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.resolver = resolver
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def addresses(self, host, port):
+        """
+        Distinct addresses for host, in resolver order
+        """
+        now = time.monotonic()
+        hit = self._entries.get((host, port))
+        if hit is not None and hit[0] > now:
+            return hit[1]
+        infos = self.resolver(host, port, 0, socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[(host, port)] = (now + self.ttl, addresses)
+        return addresses
+
+
+class _CachedDNSMixin:
+    """
+    Connects to the cached addresses in turn; TLS still verifies self.host
+    """
+
+    dns_cache = None
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = self.dns_cache.addresses(host, self.port)
+        except OSError as e:
+            raise NewConnectionError(self, f"Failed to establish a new connection: {e}")
+        error = None
+        try:
+            for address in addresses:
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except NewConnectionError as e:
+                    error = e
+        finally:
+            self._dns_host = host
+        raise error
+
+
+class DNSCachingAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose pools resolve host names through a shared DNSCache
+    """
+
+    def __init__(self, dns_cache, **kwargs):
+        mixin = (_CachedDNSMixin,)
+        attrs = {'dns_cache': dns_cache}
+        http_conn = type('CachedDNSHTTPConnection', mixin + (HTTPConnection,), attrs)
+        https_conn = type('CachedDNSHTTPSConnection', mixin + (HTTPSConnection,), attrs)
+        self._pool_classes = {
+            'http': type('CachedDNSHTTPConnectionPool', (HTTPConnectionPool,), {'ConnectionCls': http_conn}),
+            'https': type('CachedDNSHTTPSConnectionPool', (HTTPSConnectionPool,), {'ConnectionCls': https_conn}),
+        }
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = self._pool_classes
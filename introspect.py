@@ -0,0 +1,317 @@
+"""
+Live introspection of a running proxy worker.
+
+StreamRegistry tracks every in-flight proxied request (target, age, bytes
+sent, phase, bytes buffered). Subsystems register memory probes with
+register_memory() and counters with register_stats(). admin_blueprint()
+exposes all of it over HTTP, together with on-demand tracemalloc snapshot
+diffs and a sampling CPU profiler. Nothing here
+runs unless the admin endpoint is enabled: the proxy skips tracking when no
+registry exists, tracemalloc is off until asked for, and the profiler only
+samples while a capture is running.
+"""
+
+import hmac
+import itertools
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from flask import Blueprint, Response, abort, jsonify, request
+
+# Longest CPU profile capture, in seconds
+MAX_PROFILE_SECONDS = 60
+
+# Allocation sites listed in a tracemalloc diff
+TRACEMALLOC_TOP = 25
+
+# Accepted ?key= values for tracemalloc snapshots
+TRACEMALLOC_KEYS = ('lineno', 'filename', 'traceback')
+
+
+class StreamInfo:
+    """
+    One in-flight proxied request
+    """
+
+    __slots__ = ('id', 'method', 'url', 'host', 'started', 'phase', 'bytes_sent', 'buffered')
+
+    def __init__(self, stream_id, method, url, host):
+        self.id = stream_id
+        self.method = method
+        self.url = url
+        self.host = host
+        self.started = time.monotonic()
+        self.phase = 'connecting'
+        self.bytes_sent = 0
+        # Callable returning bytes held in buffers for this stream, if any
+        self.buffered = None
+
+    def buffered_bytes(self):
+        return self.buffered() if self.buffered is not None else 0
+
+    def as_dict(self, now):
+        return {
+            'id': self.id,
+            'method': self.method,
+            'url': self.url,
+            'host': self.host,
+            'age': round(now - self.started, 3),
+            'phase': self.phase,
+            'bytes_sent': self.bytes_sent,
+            'buffered_bytes': self.buffered_bytes(),
+        }
+
+
+class StreamRegistry:
+    """
+    In-flight requests of this worker, keyed by id
+    """
+
+    def __init__(self):
+        self._streams = {}
+        self._ids = itertools.count(1)
+
+    def __len__(self):
+        return len(self._streams)
+
+    def open(self, method, url, host):
+        info = StreamInfo(next(self._ids), method, url, host)
+        self._streams[info.id] = info
+        return info
+
+    def close(self, info):
+        self._streams.pop(info.id, None)
+
+    def snapshot(self):
+        now = time.monotonic()
+        return [info.as_dict(now) for info in list(self._streams.values())]
+
+    def buffered_bytes(self):
+        return sum(info.buffered_bytes() for info in list(self._streams.values()))
+
+
+_memory_probes = {}
+_stats_probes = {}
+
+
+def register_memory(name, probe):
+    """
+    Report probe() (a byte count) under `name` in the memory accounting
+    """
+    _memory_probes[name] = probe
+
+
+def register_stats(name, probe):
+    """
+    Report probe() (a JSON-serializable dict) under `name` in /stats
+    """
+    _stats_probes[name] = probe
+
+
+def process_rss():
+    """
+    Resident set size of this process in bytes, or None if unknown
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except (ImportError, OSError):
+        return None
+
+
+def memory_report():
+    """
+    Per-subsystem byte counts plus process totals
+    """
+    subsystems = {}
+    for name, probe in list(_memory_probes.items()):
+        try:
+            subsystems[name] = probe()
+        except Exception as e:
+            subsystems[name] = f"error: {e}"
+    report = {'rss': process_rss(), 'subsystems': subsystems}
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        report['tracemalloc'] = {'current': current, 'peak': peak}
+    return report
+
+
+class _Tracemalloc:
+    """
+    tracemalloc control: start, diff against the previous snapshot, stop
+    """
+
+    def __init__(self):
+        self.baseline = None
+        self.lock = threading.Lock()
+
+    def start(self, frames):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self.baseline = tracemalloc.take_snapshot()
+        return {'tracing': True}
+
+    def snapshot(self, key_type):
+        with self.lock:
+            if not tracemalloc.is_tracing():
+                return None
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            if self.baseline is None:
+                stats = snapshot.statistics(key_type)
+                top = [{'site': str(s.traceback), 'size': s.size, 'count': s.count}
+                       for s in stats[:TRACEMALLOC_TOP]]
+            else:
+                stats = snapshot.compare_to(self.baseline, key_type)
+                top = [{'site': str(s.traceback), 'size': s.size, 'size_diff': s.size_diff,
+                        'count': s.count, 'count_diff': s.count_diff}
+                       for s in stats[:TRACEMALLOC_TOP]]
+            self.baseline = snapshot
+        return {'tracing': True, 'top': top}
+
+    def stop(self):
+        with self.lock:
+            tracemalloc.stop()
+            self.baseline = None
+        return {'tracing': False}
+
+
+def _thread_cpu_time(thread_id):
+    """
+    CPU seconds used by a thread, or None where per-thread clocks are missing
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+
+def sample_profile(seconds, interval):
+    """
+    Sample the stacks of threads using CPU for `seconds`; return collapsed stacks
+
+    A thread is counted on a tick only if its CPU clock advanced since the
+    previous tick, so threads blocked in select() or waiting on a queue do
+    not show up. Where per-thread CPU clocks are unavailable every thread is
+    counted (wall-clock sampling). The result is one "frame;frame;frame
+    count" line per distinct stack, outermost frame first, as consumed by
+    flamegraph.pl and speedscope.
+    """
+    me = threading.get_ident()
+    counts = Counter()
+    cpu_times = {}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            cpu = _thread_cpu_time(thread_id)
+            previous = cpu_times.get(thread_id)
+            cpu_times[thread_id] = cpu
+            if cpu is not None and (previous is None or cpu <= previous):
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            counts[';'.join(reversed(stack))] += 1
+        time.sleep(interval)
+    return ''.join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+def admin_blueprint(registry, token):
+    """
+    Flask blueprint with the introspection endpoints, guarded by a bearer token
+    """
+    admin = Blueprint('admin', __name__, url_prefix='/_cybersplicer')
+    tracing = _Tracemalloc()
+    profiling = threading.Lock()
+
+    @admin.before_request
+    def check_token():
+        # Header only: a query-string token would end up in access logs
+        supplied = request.headers.get('Authorization', '')
+        if not supplied.startswith('Bearer '):
+            abort(403)
+        supplied = supplied[len('Bearer '):]
+        if not hmac.compare_digest(supplied.encode(), token.encode()):
+            abort(403)
+
+    @admin.route('/streams')
+    def streams():
+        """
+        Every in-flight proxied request of this worker
+        """
+        return jsonify({'pid': os.getpid(), 'count': len(registry), 'streams': registry.snapshot()})
+
+    @admin.route('/memory')
+    def memory():
+        """
+        Per-subsystem memory accounting
+        """
+        return jsonify(memory_report())
+
+    @admin.route('/stats')
+    def stats():
+        """
+        Counters reported by subsystems
+        """
+        return jsonify({name: probe() for name, probe in list(_stats_probes.items())})
+
+    @admin.route('/tracemalloc', methods=['GET', 'POST'])
+    def tracemalloc_control():
+        """
+        ?action=start|snapshot|stop; snapshot diffs against the previous one
+
+        start and stop change the process state and must be POSTed.
+        """
+        action = request.args.get('action', 'snapshot')
+        if action in ('start', 'stop') and request.method != 'POST':
+            abort(405)
+        if action == 'start':
+            frames = request.args.get('frames', 1, type=int)
+            if not 1 <= frames <= 65535:
+                abort(400)
+            return jsonify(tracing.start(frames))
+        if action == 'stop':
+            return jsonify(tracing.stop())
+        if action == 'snapshot':
+            key_type = request.args.get('key', 'lineno')
+            if key_type not in TRACEMALLOC_KEYS:
+                abort(400)
+            result = tracing.snapshot(key_type)
+            if result is None:
+                return jsonify({'tracing': False, 'error': 'call ?action=start first'}), 409
+            return jsonify(result)
+        abort(400)
+
+    @admin.route('/profile')
+    def profile():
+        """
+        Sampling CPU profile as collapsed stacks; idle threads are left out
+        """
+        seconds = min(request.args.get('seconds', 5, type=float), MAX_PROFILE_SECONDS)
+        interval = max(request.args.get('interval', 0.005, type=float), 0.001)
+        if not profiling.acquire(blocking=False):
+            return Response('A profile is already being captured\n', status=409, mimetype='text/plain')
+        try:
+            return Response(sample_profile(seconds, interval), mimetype='text/plain')
+        finally:
+            profiling.release()
+
+    return admin
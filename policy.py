@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+Domain / URL-prefix policy engine for the proxy.
+
+Rules are compiled offline from plain-text blocklists into a compact binary
+file holding sorted arrays of 64-bit hashes: one for domain suffixes and
+one for host + path prefixes (plus the hosts that have prefix rules, so most
+lookups never look at paths). At runtime the file is memory-mapped read-only,
+so startup does not depend on the number of rules and pre-forked workers share
+the same pages. A lookup hashes each label suffix of the host (and each path
+segment prefix of the URL) and binary-searches the arrays; per-host results
+are kept in a small cache, so repeat lookups for busy hosts are a dict hit.
+
+Build a rules file:
+
+    python policy.py build -o rules.bin blocklist1.txt blocklist2.txt
+
+Rebuild into a temporary file and rename it over the old one to hot-swap a
+running proxy; the engine notices the new file on its next periodic check.
+"""
+
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from array import array
+
+MAGIC = b'CSPL'
+VERSION = 1
+
+# magic, version, flags, number of domain / prefix / prefix-host hashes
+HEADER = struct.Struct('<4sHHQQQ')
+HEADER_SIZE = 64
+
+# Hosts whose domain decision is cached per loaded rules file
+HOST_CACHE_SIZE = 65536
+
+MODES = ('enforce', 'simulate')
+
+# "#" starts a comment at the start of a line or after whitespace
+COMMENT = re.compile(r'(?:^|\s)#')
+
+# Characters allowed in a (normalized, IDNA-encoded) rule host
+HOST_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz0123456789.-_[]:')
+
+
+class PolicyError(Exception):
+    """
+    Raised when a rules file is missing, truncated or of the wrong format
+    """
+
+
+def rule_hash(key):
+    """
+    64-bit hash of a normalized rule key, stable across processes
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def normalize_host(host):
+    """
+    Lower-case a host name and strip the trailing dot, port and IDNA-encode it
+    """
+    host = host.strip().lower().rstrip('.')
+    if host.startswith('['):
+        return host
+    host = host.split(':', 1)[0]
+    if host.isascii():
+        return host
+    try:
+        return host.encode('idna').decode('ascii')
+    except UnicodeError:
+        return host
+
+
+def parse_rule(line):
+    """
+    Parse one blocklist line into ('domain', key), ('prefix', key) or None
+
+    Understands plain domains, hosts-file entries ("0.0.0.0 example.com"),
+    wildcard domains ("*.example.com"), adblock-style domain anchors
+    ("||example.com^") and URL prefixes ("example.com/ads/", "https://...").
+    Adblock options ("$third-party") are dropped, so the rule applies to
+    every request. Returns None for blank and comment lines and raises
+    ValueError for rules that cannot be expressed as a domain or prefix
+    (exceptions, regexes, inner wildcards, element hiding).
+    """
+    if any(marker in line for marker in ('##', '#@#', '#?#', '#$#')):
+        raise ValueError(f"unsupported rule: {line.strip()}")
+    line = COMMENT.split(line, 1)[0].strip()
+    if not line or line.startswith('!') or line.startswith('['):
+        return None
+
+    # hosts-file format: "<ip> <domain> [aliases...]"
+    parts = line.split()
+    if len(parts) > 1:
+        line = parts[1]
+
+    if line.startswith('@@') or line.startswith('/'):
+        raise ValueError(f"unsupported rule: {line}")
+    if line.startswith('||'):
+        line = line[2:]
+    line = line.split('$', 1)[0]
+    # "^" is a separator: the end of the rule or a path boundary
+    line = line.rstrip('^').replace('^', '/')
+    if line.startswith('*.'):
+        line = line[2:]
+    if '*' in line or '|' in line:
+        raise ValueError(f"unsupported rule: {line}")
+
+    if '://' not in line:
+        line = 'http://' + line
+    parsed = urllib.parse.urlsplit(line)
+    host = normalize_host(parsed.netloc)
+    if host in ('localhost', '0.0.0.0', '127.0.0.1'):
+        return None
+    if not host or not HOST_CHARS.issuperset(host) or host.startswith('.'):
+        raise ValueError(f"invalid host in rule: {line}")
+
+    path = parsed.path.rstrip('/')
+    if path:
+        return 'prefix', host + path
+    return 'domain', host
+
+
+def split_url(url):
+    """
+    Split an absolute URL into (netloc, rest) with two partition() calls
+
+    rest is everything after the '/' that ends the netloc. A URL without a
+    path keeps its '?query' or '#fragment' on the netloc; _match_host()
+    strips them, and url_path() parses the path properly when it is needed.
+    """
+    scheme, sep, rest = url.partition('://')
+    netloc, _, rest = (rest if sep else url).partition('/')
+    return netloc, rest
+
+
+def url_path(url):
+    """
+    Path of a URL without query or fragment, '' if it has none
+    """
+    scheme, sep, rest = url.partition('://')
+    rest = (rest if sep else url).partition('?')[0].partition('#')[0]
+    slash = rest.find('/')
+    return rest[slash:] if slash != -1 else ''
+
+
+def domain_keys(host):
+    """
+    Yield every label suffix of a host, longest first
+    """
+    yield host
+    dot = host.find('.')
+    while dot != -1:
+        yield host[dot + 1:]
+        dot = host.find('.', dot + 1)
+
+
+def prefix_keys(host, path):
+    """
+    Yield host + path prefixes cut at each segment boundary, longest first
+    """
+    path = path.rstrip('/')
+    while path:
+        yield host + path
+        path = path[:path.rfind('/')]
+
+
+class _PolicyTable:
+    """
+    One memory-mapped rules file
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size < HEADER_SIZE:
+                raise PolicyError(f"{path}: file too short")
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _flags, n_domains, n_prefixes, n_hosts = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise PolicyError(f"{path}: not a version {VERSION} policy file")
+        if HEADER_SIZE + 8 * (n_domains + n_prefixes + n_hosts) != st.st_size:
+            raise PolicyError(f"{path}: truncated policy file")
+        if sys.byteorder != 'little':
+            raise PolicyError("policy files require a little-endian host")
+
+        self.identity = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+        self.size = st.st_size
+        hashes = memoryview(self.mm)[HEADER_SIZE:].cast('Q')
+        self.domains = hashes[:n_domains]
+        self.prefixes = hashes[n_domains:n_domains + n_prefixes]
+        self.prefix_hosts = hashes[n_domains + n_prefixes:]
+        self.host_cache = {}
+
+    def __len__(self):
+        return len(self.domains) + len(self.prefixes)
+
+
+def _contains(table, value):
+    """
+    Binary search a sorted hash array
+    """
+    i = bisect.bisect_left(table, value)
+    return i != len(table) and table[i] == value
+
+
+class PolicyEngine:
+    """
+    Matches URLs against a compiled rules file and hot-swaps it when it changes
+    """
+
+    def __init__(self, path, mode='enforce', check_interval=1.0):
+        if mode not in MODES:
+            raise ValueError(f"policy mode must be one of {MODES}")
+        self.path = path
+        self.mode = mode
+        self.check_interval = check_interval
+        self._table = _PolicyTable(path)
+        self._next_check = time.monotonic() + check_interval
+        self._reload_lock = threading.Lock()
+
+    @property
+    def enforcing(self):
+        return self.mode == 'enforce'
+
+    @property
+    def rule_count(self):
+        return len(self._table)
+
+    @property
+    def mapped_bytes(self):
+        return self._table.size
+
+    @property
+    def host_cache_bytes(self):
+        """
+        Approximate size of this worker's per-host decision cache
+        """
+        cache = self._table.host_cache
+        return sys.getsizeof(cache) + sum(
+            sys.getsizeof(netloc) + sys.getsizeof(result) + sys.getsizeof(result[1])
+            for netloc, result in list(cache.items()))
+
+    def maybe_reload(self):
+        """
+        Swap in a rebuilt rules file if the one on disk has changed
+        """
+        now = time.monotonic()
+        if now < self._next_check or not self._reload_lock.acquire(blocking=False):
+            return False
+        try:
+            self._next_check = now + self.check_interval
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return False
+            if (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size) == self._table.identity:
+                return False
+            try:
+                table = _PolicyTable(self.path)
+            except (OSError, PolicyError):
+                # Keep serving the previous rules until a complete file appears
+                return False
+            # The old table stays mapped until in-flight lookups drop it
+            self._table = table
+            return True
+        finally:
+            self._reload_lock.release()
+
+    def match(self, url):
+        """
+        Return the rule key that matches a URL, or None if it is allowed
+        """
+        if time.monotonic() >= self._next_check:
+            self.maybe_reload()
+        table = self._table
+
+        netloc, _ = split_url(url)
+        cached = table.host_cache.get(netloc)
+        if cached is None:
+            cached = self._match_host(table, netloc)
+
+        matched, host, has_prefix_rules = cached
+        if matched or not has_prefix_rules:
+            return matched
+        for key in prefix_keys(host, url_path(url)):
+            if _contains(table.prefixes, rule_hash(key)):
+                return key
+        return None
+
+    @staticmethod
+    def _match_host(table, netloc):
+        """
+        Domain decision for a netloc: (matched key, host, has prefix rules)
+        """
+        host = normalize_host(netloc.partition('?')[0].partition('#')[0].rsplit('@', 1)[-1])
+        matched = None
+        for key in domain_keys(host):
+            if _contains(table.domains, rule_hash(key)):
+                matched = key
+                break
+        result = (matched, host, bool(host) and _contains(table.prefix_hosts, rule_hash(host)))
+
+        if len(table.host_cache) >= HOST_CACHE_SIZE:
+            table.host_cache.clear()
+        table.host_cache[netloc] = result
+        return result
+
+
+def build(sources, output):
+    """
+    Compile plain-text blocklists into a rules file, replacing it atomically
+
+    Returns the number of domain and prefix rules written and the number of
+    lines rejected as unsupported.
+    """
+    domains = set()
+    prefixes = set()
+    prefix_hosts = set()
+    rejected = 0
+    for source in sources:
+        with open(source, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    rule = parse_rule(line)
+                except ValueError:
+                    rejected += 1
+                    continue
+                if rule is None:
+                    continue
+                kind, key = rule
+                if kind == 'domain':
+                    domains.add(rule_hash(key))
+                else:
+                    prefixes.add(rule_hash(key))
+                    prefix_hosts.add(rule_hash(key.split('/', 1)[0]))
+
+    tmp = f"{output}.tmp{os.getpid()}"
+    with open(tmp, 'wb') as f:
+        header = HEADER.pack(MAGIC, VERSION, 0, len(domains), len(prefixes), len(prefix_hosts))
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for hashes in (domains, prefixes, prefix_hosts):
+            array('Q', sorted(hashes)).tofile(f)
+    os.replace(tmp, output)
+    return len(domains), len(prefixes), rejected
+
+
+def main():
+    """
+    Command line entry point for building and querying rules files
+    """
+    parser = argparse.ArgumentParser(description='Cybersplicer policy rules compiler')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    build_cmd = commands.add_parser('build', help='Compile blocklists into a rules file')
+    build_cmd.add_argument('-o', '--output', required=True, help='Rules file to write')
+    build_cmd.add_argument('sources', nargs='+', help='Plain-text blocklists')
+
+    check_cmd = commands.add_parser('check', help='Look up URLs in a rules file')
+    check_cmd.add_argument('rules', help='Compiled rules file')
+    check_cmd.add_argument('urls', nargs='+', help='URLs to check')
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        n_domains, n_prefixes, rejected = build(args.sources, args.output)
+        print(f"Wrote {args.output}: {n_domains} domain rules, {n_prefixes} prefix rules")
+        if rejected:
+            print(f"Skipped {rejected} unsupported rules", file=sys.stderr)
+    else:
+        engine = PolicyEngine(args.rules)
+        for url in args.urls:
+            if '://' not in url:
+                url = 'https://' + url
+            print(f"{url}: {engine.match(url) or 'allowed'}")
+
+
+if __name__ == '__main__':
+    main()
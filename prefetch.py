@@ -0,0 +1,313 @@
+"""
+Speculative sub-resource prefetching.
+
+While an HTML page streams to the client, Prefetcher.watch() feeds the bytes
+through an HTML parser. It picks up stylesheets, scripts, images and
+preload hints and fetches them concurrently into a short-lived response cache.
+rewrite_subresources() points the same references at the proxy (?url= form),
+so when the browser asks for one of them a moment later the request reaches
+proxy(), which serves it from the cache instead of paying origin latency
+again. Only responses that freshness() allows to be shared are cached, for as
+long as their Cache-Control allows. Each page has a limit on the number and
+total bytes of prefetches, and the counters show whether prefetching pays off.
+"""
+
+import codecs
+import html
+import re
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+
+import requests
+
+from cache import ResponseCache, freshness
+
+# <link rel=...> values worth fetching ahead of the browser
+LINK_RELS = {'stylesheet', 'preload', 'modulepreload', 'icon', 'shortcut icon'}
+
+# Only the start of a page is parsed; later references are found too late to help
+MAX_PARSE_BYTES = 256 * 1024
+
+# Client headers copied onto prefetch requests
+FORWARDED_HEADERS = ('User-Agent', 'Accept-Language')
+
+# Tags whose references are prefetched, and their URL attributes
+_TAG = re.compile(rb'<(link|script|img)\b[^>]*>', re.I)
+_URL_ATTR = re.compile(rb'''(\s(src|href)\s*=\s*)("[^"]*"|'[^']*'|[^\s"'>]+)''', re.I)
+_REL_ATTR = re.compile(rb'''\srel\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)''', re.I)
+_BASE = re.compile(rb'''<base\b[^>]*\shref\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)''', re.I)
+
+# Longest unfinished tag held back between chunks while rewriting
+MAX_CARRY = 8 * 1024
+
+
+def normalize_url(url, params=None):
+    """
+    URL as requests will send it, so prefetched and proxied keys agree
+    """
+    prepared = requests.models.PreparedRequest()
+    prepared.prepare_url(url, params)
+    return prepared.url
+
+
+def subresource_url(base_url, reference):
+    """
+    Absolute http(s) URL of a sub-resource reference, or None
+    """
+    if not reference or reference.startswith(('data:', 'javascript:', '#')):
+        return None
+    url = urllib.parse.urljoin(base_url, reference.strip())
+    if url.startswith(('http://', 'https://')):
+        return url.split('#', 1)[0]
+    return None
+
+
+class SubresourceParser(HTMLParser):
+    """
+    Collects absolute sub-resource URLs from (partial) HTML as it is fed
+    """
+
+    def __init__(self, base_url):
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.found = []
+
+    def _add(self, url):
+        url = subresource_url(self.base_url, url)
+        if url is not None:
+            self.found.append(url)
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'base' and attrs.get('href'):
+            self.base_url = urllib.parse.urljoin(self.base_url, attrs['href'])
+        elif tag == 'link' and (attrs.get('rel') or '').lower() in LINK_RELS:
+            self._add(attrs.get('href'))
+        elif tag in ('script', 'img'):
+            self._add(attrs.get('src'))
+
+    def take(self):
+        found, self.found = self.found, []
+        return found
+
+
+def page_charset(content_type):
+    """
+    Character set named in a Content-Type header, defaulting to UTF-8
+    """
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'charset' and value:
+            charset = value.strip('"\'')
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                break
+    return 'utf-8'
+
+
+def rewrite_subresources(page_url, chunks, charset='utf-8', proxy_prefix='/?url='):
+    """
+    Point the sub-resource references of a streamed HTML page at the proxy
+
+    The same <link>, <script src> and <img src> references SubresourceParser
+    collects are made absolute and rewritten to proxy_prefix + quoted URL, so
+    the browser requests them through proxy() and prefetched copies can be
+    served. Works on the raw bytes, so the page must be in an ASCII-compatible
+    encoding; a tag split across chunks is held back until it is complete.
+    """
+    if charset.startswith(('utf-16', 'utf-32')):
+        yield from chunks
+        return
+    base = [page_url]
+
+    def attr_value(raw):
+        if raw[:1] in (b'"', b"'"):
+            raw = raw[1:-1]
+        return html.unescape(raw.decode(charset, errors='replace'))
+
+    def rewrite_tag(match):
+        tag = match.group(0)
+        name = match.group(1).lower()
+        if name == b'link':
+            rel = _REL_ATTR.search(tag)
+            if rel is None or attr_value(rel.group(1)).lower() not in LINK_RELS:
+                return tag
+
+        def rewrite_attr(attr):
+            if (attr.group(2).lower() == b'href') != (name == b'link'):
+                return attr.group(0)
+            url = subresource_url(base[0], attr_value(attr.group(3)))
+            if url is None:
+                return attr.group(0)
+            value = (proxy_prefix + urllib.parse.quote(url, safe='')).encode('ascii')
+            return attr.group(1) + b'"' + value + b'"'
+
+        return _URL_ATTR.sub(rewrite_attr, tag)
+
+    def rewrite(data):
+        for match in _BASE.finditer(data):
+            base[0] = urllib.parse.urljoin(base[0], attr_value(match.group(1)))
+        return _TAG.sub(rewrite_tag, data)
+
+    carry = b''
+    for chunk in chunks:
+        data = carry + chunk
+        carry = b''
+        cut = data.rfind(b'<')
+        if cut != -1 and data.find(b'>', cut) == -1 and len(data) - cut <= MAX_CARRY:
+            data, carry = data[:cut], data[cut:]
+        if data:
+            yield rewrite(data)
+    if carry:
+        yield rewrite(carry)
+
+
+class _PageBudget:
+    """
+    Remaining prefetch count and bytes for one page
+    """
+
+    def __init__(self, count, nbytes):
+        self.count = count
+        self.bytes = nbytes
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        with self.lock:
+            if self.count <= 0 or self.bytes <= 0:
+                return False
+            self.count -= 1
+            return True
+
+    def spend(self, nbytes):
+        with self.lock:
+            if nbytes > self.bytes:
+                return False
+            self.bytes -= nbytes
+            return True
+
+
+class Prefetcher:
+    """
+    Fetches sub-resources of proxied pages into a short-lived cache
+    """
+
+    def __init__(self, max_per_page=16, max_bytes_per_page=4 * 1024 * 1024,
+                 max_resource_bytes=1024 * 1024, ttl=30, workers=8, allow=None, verify=True):
+        self.max_per_page = max_per_page
+        self.max_bytes_per_page = max_bytes_per_page
+        self.max_resource_bytes = max_resource_bytes
+        self.verify = verify
+        # Predicate on URLs, e.g. the filtering policy
+        self.allow = allow or (lambda url: True)
+        self.cache = ResponseCache(max_entries=1024, max_bytes=32 * 1024 * 1024,
+                                   max_entry_bytes=max_resource_bytes, max_ttl=ttl)
+        self.ttl = ttl
+        self.stats = {'pages': 0, 'scheduled': 0, 'stored': 0, 'skipped': 0, 'failed': 0,
+                      'hits': 0, 'bytes_fetched': 0, 'bytes_served': 0}
+        self._stats_lock = threading.Lock()
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+    def report(self):
+        """
+        Counters plus hit rate (hits per stored prefetch) and cache size
+        """
+        stats = dict(self.stats)
+        stats['hit_rate'] = round(stats['hits'] / stats['stored'], 3) if stats['stored'] else None
+        stats['cached_entries'] = len(self.cache)
+        stats['cached_bytes'] = self.cache.size_bytes
+        return stats
+
+    def lookup(self, url, accept_encoding):
+        """
+        A prefetched response for a proxied GET, or None
+        """
+        cached = self.cache.get((url, accept_encoding or ''))
+        if cached is not None:
+            self._count('hits')
+            self._count('bytes_served', len(cached.body))
+        return cached
+
+    def _fetch(self, url, headers, accept_encoding, budget):
+        """
+        Worker: fetch one sub-resource within the page's byte budget
+        """
+        key = (url, accept_encoding)
+        try:
+            resp = self._session.get(url, headers=headers, stream=True,
+                                     allow_redirects=False, timeout=10, verify=self.verify)
+            with resp:
+                length = resp.headers.get('Content-Length', '')
+                # Only what any client may get from a shared cache, for as long as allowed
+                ttl = freshness(resp.headers, self.ttl)
+                if (resp.status_code != 200 or not ttl
+                        or (length.isdigit() and int(length) > self.max_resource_bytes)):
+                    self._count('skipped')
+                    return
+                body = resp.raw.read(self.max_resource_bytes + 1, decode_content=False)
+                if len(body) > self.max_resource_bytes or not budget.spend(len(body)):
+                    self._count('skipped')
+                    return
+                response_headers = {k: v for k, v in resp.headers.items() if k.lower() != 'transfer-encoding'}
+                self._count('bytes_fetched', len(body))
+                if self.cache.put(key, resp.status_code, response_headers, body, ttl):
+                    self._count('stored')
+        except requests.exceptions.RequestException:
+            self._count('failed')
+        finally:
+            with self._inflight_lock:
+                self._inflight.discard(key)
+
+    def _schedule(self, urls, headers, accept_encoding, budget):
+        for url in urls:
+            try:
+                url = normalize_url(url)
+            except requests.exceptions.RequestException:
+                continue
+            key = (url, accept_encoding)
+            if not self.allow(url):
+                continue
+            with self._inflight_lock:
+                if key in self._inflight or key in self.cache:
+                    continue
+                if not budget.reserve():
+                    return
+                self._inflight.add(key)
+            self._count('scheduled')
+            self._executor.submit(self._fetch, url, headers, accept_encoding, budget)
+
+    def watch(self, page_url, content_type, request_headers, chunks):
+        """
+        Pass an HTML body through unchanged while prefetching what it references
+        """
+        decoder = codecs.getincrementaldecoder(page_charset(content_type))(errors='replace')
+
+        headers = {k: v for k, v in request_headers.items() if k in FORWARDED_HEADERS}
+        headers['Referer'] = page_url
+        accept_encoding = request_headers.get('Accept-Encoding', '')
+        if accept_encoding:
+            headers['Accept-Encoding'] = accept_encoding
+        budget = _PageBudget(self.max_per_page, self.max_bytes_per_page)
+        parser = SubresourceParser(page_url)
+        parsed = 0
+        self._count('pages')
+
+        for chunk in chunks:
+            if parsed < MAX_PARSE_BYTES:
+                parsed += len(chunk)
+                parser.feed(decoder.decode(chunk))
+                self._schedule(parser.take(), headers, accept_encoding, budget)
+            yield chunk
@@ -647,12 +647,23 @@ HTML_TEMPLATE = """
 if __name__ == '__main__':
     from flask import Flask, request, Response, stream_with_context, render_template_string
     import requests
+    import urllib3
     import logging
     import argparse
     import urllib.parse
     import time
+    import functools
     import os
 
+    from policy import PolicyEngine, MODES as POLICY_MODES
+    from ratelimit import RateLimiter
+    from segmented import SegmentedFetch, can_segment
+    from compression import compress_response
+    from introspect import StreamRegistry, admin_blueprint, register_memory, register_stats
+    from prefetch import Prefetcher, normalize_url, page_charset, rewrite_subresources
+    from cache import cacheable_request
+    from wsrelay import WebSocketRelay, is_upgrade
+
     app = Flask(__name__)
 
     # Set up logging
@@ -663,8 +674,32 @@ if __name__ == '__main__':
     )
     logger = logging.getLogger('web_proxy')
 
+    # Filtering policy, loaded in main() when --policy is given
+    policy = None
+
+    # Per-client request and bandwidth limits, set up in main()
+    limiter = None
+
+    # Parallel range fetching of large downloads, configured in main()
+    parallel_fetch = {'connections': 0, 'min_size': 0, 'segment_size': 0}
+
+    # Compress uncompressed text responses for clients that accept it
+    compress_responses = True
+
+    # In-flight request tracking, only when the admin endpoint is enabled
+    streams = None
+
+    # Sub-resource prefetching into a short-lived cache, set up in main()
+    prefetcher = None
+
+    # Relay for WebSocket upgrades, set up in main()
+    ws_relay = None
+
     @app.route('/', defaults={'path': ''})
     @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE', 'HEAD', 'OPTIONS'])
+    # Werkzeug only routes Upgrade: websocket requests to websocket rules
+    @app.route('/', defaults={'path': ''}, websocket=True)
+    @app.route('/<path:path>', websocket=True)
     def proxy(path):
         """
         Main proxy function that handles all incoming requests
@@ -677,7 +712,7 @@ if __name__ == '__main__':
             return render_template_string(HTML_TEMPLATE, current_year=time.strftime("%Y"))
         
         # Make sure the URL has a scheme
-        if not target_url.startswith(('http://', 'https://')):
+        if not target_url.startswith(('http://', 'https://', 'ws://', 'wss://')):
             target_url = 'https://' + target_url
         
         # Get the full URL including the path
@@ -685,56 +720,181 @@ if __name__ == '__main__':
             parsed_url = urllib.parse.urlparse(target_url)
             target_url = f"{parsed_url.scheme}://{parsed_url.netloc}/{path}"
         
+        # Check the target against the filtering policy
+        if policy is not None:
+            rule = policy.match(target_url)
+            if rule is not None:
+                logger.info(f"Policy {policy.mode}: {target_url} matches {rule}")
+                if policy.enforcing:
+                    blocked_html = render_template_string(
+                        HTML_TEMPLATE.replace(
+                            '<p class="tagline">Neural network infiltration system :: Bypass-level ALPHA</p>',
+                            f'<p class="tagline" style="color: #e74c3c;">Blocked by policy: {rule}</p>'
+                        ),
+                        current_year=time.strftime("%Y")
+                    )
+                    return blocked_html, 403
+        
+        # Apply the client's request rate limit
+        client_key = None
+        if limiter is not None:
+            client_key = limiter.key(request.remote_addr, urllib.parse.urlparse(target_url).netloc)
+            retry_after = limiter.allow_request(client_key)
+            if retry_after:
+                logger.info(f"Rate limited {client_key}")
+                return Response('Too many requests', status=429,
+                                headers={'Retry-After': str(int(retry_after) + 1)})
+        
         # Log the request
         logger.info(f"Proxying request to: {target_url}")
         
         # Copy the request headers
         headers = {key: value for key, value in request.headers.items() if key.lower() not in ['host', 'content-length']}
+        # Only ask for encodings the client accepts: requests would otherwise add
+        # gzip, and the body is forwarded undecoded
+        headers.setdefault('Accept-Encoding', 'identity')
+        if (prefetcher is not None and request.method == 'GET'
+                and 'text/html' in request.headers.get('Accept', '')):
+            # Pages must arrive uncompressed to be scanned and rewritten;
+            # compress_response() re-encodes them for the client
+            headers['Accept-Encoding'] = 'identity'
+        params = {k: v for k, v in request.args.items() if k != 'url'}
+        
+        # Serve sub-resources that were prefetched while their page loaded
+        if prefetcher is not None and cacheable_request(request.method, headers):
+            cached = prefetcher.lookup(normalize_url(target_url, params), request.headers.get('Accept-Encoding'))
+            if cached is not None:
+                body = [cached.body]
+                if limiter is not None:
+                    body = limiter.throttle(client_key, body)
+                return Response(body, status=cached.status, headers=cached.headers)
+        
+        # Track the request for the admin endpoint
+        stream = None
+        if streams is not None:
+            stream = streams.open(request.method, target_url, urllib.parse.urlparse(target_url).netloc)
         
         try:
-            # Forward the request to the target server
-            resp = requests.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                data=request.get_data(),
-                cookies=request.cookies,
-                params={k: v for k, v in request.args.items() if k != 'url'},
-                allow_redirects=False,
-                stream=True,
-                verify=True  # You might want to set this to False for testing purposes
-            )
+            # Hand WebSocket upgrades to the relay
+            if ws_relay is not None and is_upgrade(request.headers):
+                ws_url = target_url
+                if params:
+                    ws_url += ('&' if '?' in ws_url else '?') + urllib.parse.urlencode(params)
+                # Connections are counted per address, bandwidth per limiter key
+                on_close = None
+                if stream is not None:
+                    on_close = functools.partial(streams.close, stream)
+                return ws_relay.handle(request.environ, ws_url, request.headers, request.remote_addr,
+                                       client_key, stream, on_close)
+        
+            try:
+                # Forward the request to the target server
+                resp = requests.request(
+                    method=request.method,
+                    url=target_url,
+                    headers=headers,
+                    data=request.get_data(),
+                    cookies=request.cookies,
+                    params=params,
+                    allow_redirects=False,
+                    stream=True,
+                    verify=True  # You might want to set this to False for testing purposes
+                )
             
-            # Create a response object
-            response_headers = {key: value for key, value in resp.headers.items() if key.lower() not in ['transfer-encoding']}
+                # Create a response object
+                response_headers = {key: value for key, value in resp.headers.items() if key.lower() not in ['transfer-encoding']}
             
-            # Function to rewrite links in HTML content
-            def generate():
-                for chunk in resp.iter_content(chunk_size=4096):
-                    # For HTML content, you might want to rewrite links
-                    # This is a simplified example and could be expanded
-                    yield chunk
+                # Fetch large downloads as parallel byte ranges when the origin allows it
+                fetcher = None
+                if parallel_fetch['connections'] and can_segment(request.method, headers, resp, parallel_fetch['min_size']):
+                    logger.info(f"Fetching {target_url} in parallel segments")
+                    fetcher = SegmentedFetch(
+                        resp.url,
+                        resp,
+                        request_headers=headers,
+                        connections=parallel_fetch['connections'],
+                        segment_size=parallel_fetch['segment_size']
+                    )
+                    if stream is not None:
+                        stream.buffered = lambda: fetcher.buffered_bytes
             
-            # Return the response
-            return Response(
-                stream_with_context(generate()),
-                status=resp.status_code,
-                headers=response_headers,
-                content_type=resp.headers.get('content-type', 'text/html')
-            )
-        
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error proxying request: {e}")
+                if fetcher is not None:
+                    body = iter(fetcher)
+                else:
+                    # Forward the body exactly as sent, so Content-Length,
+                    # Content-Encoding and 206 Content-Range stay valid
+                    body = resp.raw.stream(4096, decode_content=False)
             
-            # Return error page with the beautiful interface
-            error_html = render_template_string(
-                HTML_TEMPLATE.replace(
-                    '<p class="tagline">Neural network infiltration system :: Bypass-level ALPHA</p>',
-                    f'<p class="tagline" style="color: #e74c3c;">Error: {e}</p>'
-                ),
-                current_year=time.strftime("%Y")
-            )
-            return error_html, 500
+                # Prefetch what an HTML page references while it streams
+                content_type = resp.headers.get('content-type', '')
+                if (prefetcher is not None and request.method == 'GET' and resp.status_code == 200
+                        and content_type.startswith('text/html') and 'Content-Encoding' not in resp.headers):
+                    body = prefetcher.watch(resp.url, content_type, request.headers, body)
+                    # Send the browser's requests for those resources back through the proxy
+                    body = rewrite_subresources(resp.url, body, page_charset(content_type),
+                                                request.script_root + '/?url=')
+                    response_headers = {
+                        key: ('W/' + value if key.lower() == 'etag' and not value.startswith('W/') else value)
+                        for key, value in response_headers.items() if key.lower() != 'content-length'
+                    }
+            
+                # Compress text bodies the origin sent uncompressed
+                if stream is not None:
+                    stream.phase = 'reading'
+                if compress_responses:
+                    body, response_headers = compress_response(
+                        request.method,
+                        resp.status_code,
+                        response_headers,
+                        request.headers.get('Accept-Encoding'),
+                        body
+                    )
+            
+                # Stream the (rewritten, compressed) body to the client
+                def generate():
+                    chunks = body
+                    if limiter is not None:
+                        # Pace the body to the client's bandwidth limit
+                        chunks = limiter.throttle(client_key, chunks)
+                    if stream is not None:
+                        stream.phase = 'streaming'
+                    for chunk in chunks:
+                        if stream is not None:
+                            stream.bytes_sent += len(chunk)
+                        yield chunk
+            
+                # Return the response
+                response = Response(
+                    stream_with_context(generate()),
+                    status=resp.status_code,
+                    headers=response_headers,
+                    content_type=resp.headers.get('content-type', 'text/html')
+                )
+                if stream is not None:
+                    response.call_on_close(lambda: streams.close(stream))
+                return response
+        
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError, OSError) as e:
+                # compress_response() reads the first chunk here, so errors from the
+                # body stream (resets, truncated chunks) can land here too
+                logger.error(f"Error proxying request: {e}")
+                if stream is not None:
+                    streams.close(stream)
+            
+                # Return error page with the beautiful interface
+                error_html = render_template_string(
+                    HTML_TEMPLATE.replace(
+                        '<p class="tagline">Neural network infiltration system :: Bypass-level ALPHA</p>',
+                        f'<p class="tagline" style="color: #e74c3c;">Error: {e}</p>'
+                    ),
+                    current_year=time.strftime("%Y")
+                )
+                return error_html, 500
+        except BaseException:
+            # Whatever escapes the view must not leave the request listed forever
+            if stream is not None:
+                streams.close(stream)
+            raise
 
     def main():
         """
@@ -744,7 +904,96 @@ if __name__ == '__main__':
         parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
         parser.add_argument('--port', default=8080, type=int, help='Port to bind to')
         parser.add_argument('--debug', action='store_true', help='Enable debug mode')
+        parser.add_argument('--policy', help='Compiled policy rules file (see policy.py build)')
+        parser.add_argument('--policy-mode', default='enforce', choices=POLICY_MODES,
+                            help='Block matching requests or only log them')
+        parser.add_argument('--parallel-fetch', default=0, type=int,
+                            help='Connections used to fetch large downloads in parallel ranges (0 = off)')
+        parser.add_argument('--parallel-min-size', default=16 * 1024 * 1024, type=int,
+                            help='Smallest response, in bytes, fetched in parallel ranges')
+        parser.add_argument('--parallel-segment-size', default=4 * 1024 * 1024, type=int,
+                            help='Size in bytes of each parallel range request')
+        parser.add_argument('--no-compress', action='store_true',
+                            help='Forward uncompressed responses as-is instead of gzip/Brotli-compressing them')
+        parser.add_argument('--prefetch', action='store_true',
+                            help='Prefetch stylesheets, scripts and images of proxied pages and route them through the proxy')
+        parser.add_argument('--prefetch-max-resources', default=16, type=int,
+                            help='Most sub-resources prefetched per page')
+        parser.add_argument('--prefetch-max-bytes', default=4 * 1024 * 1024, type=int,
+                            help='Most bytes prefetched per page')
+        parser.add_argument('--websocket-max-connections', default=1000, type=int,
+                            help='Most WebSocket connections relayed at once (0 = no WebSocket support)')
+        parser.add_argument('--websocket-max-per-client', default=50, type=int,
+                            help='Most WebSocket connections per client')
+        parser.add_argument('--websocket-idle-timeout', default=300, type=float,
+                            help='Seconds without traffic before a WebSocket connection is closed')
+        parser.add_argument('--admin-token',
+                            help='Enable the /_cybersplicer introspection endpoints, protected by this token')
+        parser.add_argument('--rate-limit', default=0, type=float,
+                            help='Requests per second allowed per client (0 = unlimited)')
+        parser.add_argument('--bandwidth-limit', default=0, type=int,
+                            help='Response bytes per second allowed per client (0 = unlimited)')
+        parser.add_argument('--rate-limit-per-host', action='store_true',
+                            help='Keep separate limits for each client and target host pair')
+        parser.add_argument('--rate-limit-slots', default=65536, type=int,
+                            help='Size of the bucket table (power of two)')
+        parser.add_argument('--rate-limit-file',
+                            help='Shared memory file for the bucket table, e.g. /dev/shm/cybersplicer-ratelimit')
         args = parser.parse_args()
+        if args.parallel_segment_size <= 0:
+            parser.error('--parallel-segment-size must be positive')
+        
+        global policy, limiter, compress_responses, streams, prefetcher, ws_relay
+        if args.policy:
+            policy = PolicyEngine(args.policy, mode=args.policy_mode)
+            logger.info(f"Loaded {policy.rule_count} policy rules from {args.policy} ({args.policy_mode})")
+        compress_responses = not args.no_compress
+        parallel_fetch.update(
+            connections=args.parallel_fetch,
+            min_size=args.parallel_min_size,
+            segment_size=args.parallel_segment_size
+        )
+        if args.rate_limit or args.bandwidth_limit:
+            limiter = RateLimiter(
+                requests_per_second=args.rate_limit,
+                bytes_per_second=args.bandwidth_limit,
+                per_host=args.rate_limit_per_host,
+                slots=args.rate_limit_slots,
+                path=args.rate_limit_file
+            )
+        
+        if args.prefetch:
+            prefetcher = Prefetcher(
+                max_per_page=args.prefetch_max_resources,
+                max_bytes_per_page=args.prefetch_max_bytes,
+                # Never prefetch what the policy would block
+                allow=lambda url: policy is None or not policy.enforcing or policy.match(url) is None
+            )
+        
+        if args.websocket_max_connections:
+            ws_relay = WebSocketRelay(
+                idle_timeout=args.websocket_idle_timeout,
+                max_connections=args.websocket_max_connections,
+                max_per_client=args.websocket_max_per_client,
+                limiter=limiter
+            )
+        
+        if args.admin_token:
+            streams = StreamRegistry()
+            app.register_blueprint(admin_blueprint(streams, args.admin_token))
+            register_memory('stream_buffers', streams.buffered_bytes)
+            if policy is not None:
+                register_memory('policy_rules_mapped', lambda: policy.mapped_bytes)
+                register_memory('policy_host_cache', lambda: policy.host_cache_bytes)
+            if limiter is not None:
+                register_memory('rate_limit_table', lambda: limiter.table_bytes)
+            if prefetcher is not None:
+                register_memory('prefetch_cache', lambda: prefetcher.cache.size_bytes)
+                register_stats('prefetch', prefetcher.report)
+            if ws_relay is not None:
+                register_memory('websocket_buffers', ws_relay.buffered_bytes)
+                register_stats('websocket', ws_relay.report)
+            logger.info("Introspection endpoints enabled under /_cybersplicer/")
         
         logger.info(f"Starting proxy server on {args.host}:{args.port}")
         app.run(host=args.host, port=args.port, debug=args.debug)
@@ -0,0 +1,172 @@
+"""
+Per-client token-bucket rate limiting for the proxy.
+
+Every client (or client + target host) key gets two token buckets: one for
+requests per second and one for bytes per second. Buckets live in a fixed-size,
+two-way set-associative table of packed slots, so each request costs O(1) and
+memory does not grow with the number of distinct clients: when both slots of
+a set are taken by other keys, the least recently used one is recycled (that
+client simply starts again with a full bucket).
+
+The table lives in an mmap. Without a path it is anonymous memory private to
+this proxy process. proxy.py builds its Flask app inside main(), so it cannot
+be loaded into a pre-forking server; to share limits between several proxy
+processes (e.g. one per port behind a load balancer), give each the same
+--rate-limit-file, such as /dev/shm/cybersplicer-ratelimit. The file is zeroed
+whenever it is created or resized, and slots stamped in the future (left over
+from before a reboot, since stamps are monotonic clock readings) count as
+empty. Updates from different processes are not serialized, which can let a
+few extra tokens through under contention; that is the price of keeping the
+hot path lock-free across processes.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+# tag, request tokens, byte tokens, last update (monotonic seconds)
+SLOT = struct.Struct('<Qddd')
+
+# Processes on one machine share CLOCK_MONOTONIC, so timestamps are comparable
+# between them until the next reboot
+_clock = time.monotonic
+
+
+def _tag(key):
+    """
+    Non-zero 64-bit tag for a bucket key (zero marks an empty slot)
+    """
+    tag = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+    return tag or 1
+
+
+class RateLimiter:
+    """
+    Fixed-size table of request-rate and bandwidth token buckets
+
+    A rate of 0 disables that limit. Bursts default to one second's worth.
+    """
+
+    def __init__(self, requests_per_second=0, bytes_per_second=0, request_burst=None,
+                 byte_burst=None, per_host=False, slots=65536, path=None):
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.requests_per_second = float(requests_per_second)
+        self.bytes_per_second = float(bytes_per_second)
+        self.request_burst = float(request_burst or max(requests_per_second, 1))
+        self.byte_burst = float(byte_burst or max(bytes_per_second, 1))
+        self.per_host = per_host
+        self.slots = slots
+        self._mask = (slots - 1) & ~1
+        self._lock = threading.Lock()
+
+        size = slots * SLOT.size
+        if path:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size != size:
+                    # Slots of a new or differently sized table start empty
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, size)
+                self._table = mmap.mmap(fd, size)
+            finally:
+                # mmap keeps a duplicate of fd, which would otherwise hold the lock
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+        else:
+            # Anonymous MAP_SHARED memory survives fork() as shared pages
+            self._table = mmap.mmap(-1, size)
+
+    @property
+    def table_bytes(self):
+        return len(self._table)
+
+    def key(self, client, host=None):
+        """
+        Bucket key for a client address and, if per_host is set, target host
+        """
+        if self.per_host and host:
+            return f"{client}|{host}"
+        return client
+
+    def _update(self, key, requests, nbytes):
+        """
+        Refill the key's buckets and take the given amounts
+
+        Returns (whether the request tokens were taken, request balance,
+        byte balance).
+        """
+        tag = _tag(key)
+        index = tag & self._mask
+        table = self._table
+        now = _clock()
+
+        with self._lock:
+            offset = index * SLOT.size
+            slot_tag, req_tokens, byte_tokens, updated = SLOT.unpack_from(table, offset)
+            if slot_tag != tag:
+                other = offset + SLOT.size
+                other_tag, other_req, other_bytes, other_updated = SLOT.unpack_from(table, other)
+                if other_tag == tag:
+                    offset, req_tokens, byte_tokens, updated = other, other_req, other_bytes, other_updated
+                else:
+                    # Recycle the emptier or less recently used slot of the set
+                    if other_updated < updated:
+                        offset = other
+                    req_tokens, byte_tokens, updated = self.request_burst, self.byte_burst, now
+
+            if updated > now + 1.0:
+                # Stamped before a reboot: the slot's state is meaningless
+                req_tokens, byte_tokens, updated = self.request_burst, self.byte_burst, now
+            # Another process may have stamped the slot just after our clock read
+            elapsed = max(now - updated, 0.0)
+            req_tokens = min(self.request_burst, req_tokens + elapsed * self.requests_per_second)
+            byte_tokens = min(self.byte_burst, byte_tokens + elapsed * self.bytes_per_second)
+
+            taken = req_tokens >= requests
+            if taken:
+                req_tokens -= requests
+            byte_tokens -= nbytes
+
+            SLOT.pack_into(table, offset, tag, req_tokens, byte_tokens, now)
+        return taken, req_tokens, byte_tokens
+
+    def allow_request(self, key):
+        """
+        Take one request token; return 0 if allowed, else seconds until retry
+        """
+        if not self.requests_per_second:
+            return 0
+        taken, req_tokens, _ = self._update(key, 1, 0)
+        if taken:
+            return 0
+        return (1 - req_tokens) / self.requests_per_second
+
+    def consume_bytes(self, key, nbytes):
+        """
+        Charge bytes to the key's bandwidth bucket; return seconds to wait
+
+        The bucket may go into debt, so a large chunk is always sent and the
+        wait spreads it out at the configured rate.
+        """
+        if not self.bytes_per_second:
+            return 0
+        byte_tokens = self._update(key, 0, nbytes)[2]
+        if byte_tokens >= 0:
+            return 0
+        return -byte_tokens / self.bytes_per_second
+
+    def throttle(self, key, chunks):
+        """
+        Pace a stream of response chunks to the key's bandwidth limit
+        """
+        for chunk in chunks:
+            delay = self.consume_bytes(key, len(chunk))
+            if delay:
+                time.sleep(delay)
+            yield chunk
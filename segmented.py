@@ -0,0 +1,222 @@
+"""
+Parallel segmented fetching of large downloads.
+
+When the origin answers a plain GET with a large body, advertises
+"Accept-Ranges: bytes" and gives a validator (strong ETag or Last-Modified),
+the body can be fetched as several byte ranges over parallel connections.
+SegmentedFetch keeps the already-open response for the first segment, requests
+the others with Range + If-Range, and yields the bytes back in order. At most
+`connections` segments are in flight, each with a bounded queue of chunks, so
+the reorder buffer never holds more than about `max_buffer` bytes.
+"""
+
+import queue
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import urllib3
+
+CONTENT_RANGE = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+
+# Attempts per segment before giving up on the whole download
+SEGMENT_ATTEMPTS = 3
+
+# How long blocked producers wait before re-checking for cancellation
+POLL_SECONDS = 0.5
+
+# End-of-segment marker in a segment queue
+_DONE = object()
+
+
+class SegmentError(Exception):
+    """
+    Raised when the origin does not honour a range request consistently
+    """
+
+
+def validator(resp):
+    """
+    The If-Range validator for a response: a strong ETag or Last-Modified
+    """
+    etag = resp.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return resp.headers.get('Last-Modified')
+
+
+def can_segment(method, request_headers, resp, min_size):
+    """
+    Whether a response can be fetched as parallel byte ranges
+
+    Only full 200 responses to GET requests without a client Range header
+    qualify; ranged client requests are passed through unchanged so the
+    origin's 206 answer reaches the client as-is.
+    """
+    if method != 'GET' or resp.status_code != 200:
+        return False
+    if any(key.lower() in ('range', 'if-range') for key in request_headers):
+        return False
+    if resp.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return False
+    if resp.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return False
+    if not validator(resp):
+        return False
+    try:
+        return int(resp.headers.get('Content-Length', '')) >= min_size
+    except ValueError:
+        return False
+
+
+class SegmentedFetch:
+    """
+    Iterable over the body of `first_response`, fetched in parallel ranges
+    """
+
+    def __init__(self, url, first_response, request_headers=None, connections=4,
+                 segment_size=4 * 1024 * 1024, chunk_size=64 * 1024,
+                 max_buffer=16 * 1024 * 1024, verify=True):
+        if segment_size <= 0:
+            raise ValueError("segment_size must be positive")
+        self.url = url
+        self.first_response = first_response
+        self.total = int(first_response.headers['Content-Length'])
+        self.connections = max(connections, 1)
+        self.segment_size = segment_size
+        self.chunk_size = chunk_size
+        self.verify = verify
+
+        # Range requests must see the same representation as the first response
+        self.headers = {
+            key: value for key, value in (request_headers or {}).items()
+            if key.lower() not in ('range', 'if-range', 'accept-encoding')
+        }
+        self.headers['Accept-Encoding'] = 'identity'
+        self.headers['If-Range'] = validator(first_response)
+
+        self.segments = (self.total + segment_size - 1) // segment_size
+        per_segment = max_buffer // (self.connections * chunk_size)
+        self._queue_size = max(per_segment, 2)
+        self._queues = {}
+        self._buffered = 0
+        self._buffered_lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.connections)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    @property
+    def buffered_bytes(self):
+        """
+        Bytes fetched from the origin but not yet handed to the client
+        """
+        return self._buffered
+
+    def _track(self, delta):
+        with self._buffered_lock:
+            self._buffered += delta
+
+    def _put(self, q, item):
+        """
+        Blocking put that gives up once the download is cancelled
+        """
+        while not self._cancelled.is_set():
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _open_range(self, start, end):
+        """
+        Request bytes start..end (inclusive) and check the origin honoured it
+        """
+        headers = dict(self.headers, Range=f'bytes={start}-{end}')
+        resp = self._session.get(self.url, headers=headers, stream=True,
+                                 allow_redirects=False, verify=self.verify)
+        match = CONTENT_RANGE.fullmatch(resp.headers.get('Content-Range', ''))
+        if (resp.status_code != 206 or not match
+                or (int(match.group(1)), int(match.group(2))) != (start, end)
+                or match.group(3) not in ('*', str(self.total))):
+            resp.close()
+            raise SegmentError(f"origin ignored range {start}-{end} (status {resp.status_code})")
+        return resp
+
+    def _fetch_segment(self, index):
+        """
+        Producer: stream one segment into its queue, resuming after errors
+        """
+        q = self._queues[index]
+        start = index * self.segment_size
+        end = min(start + self.segment_size, self.total) - 1
+        received = 0
+        attempts = 0
+
+        while start + received <= end:
+            # Segments queued before the client went away never hit the origin
+            if self._cancelled.is_set():
+                return
+            resp = None
+            try:
+                if index == 0 and attempts == 0:
+                    resp = self.first_response
+                else:
+                    resp = self._open_range(start + received, end)
+                remaining = end - start - received + 1
+                for chunk in resp.raw.stream(self.chunk_size, decode_content=False):
+                    chunk = chunk[:remaining]
+                    remaining -= len(chunk)
+                    received += len(chunk)
+                    self._track(len(chunk))
+                    if not self._put(q, chunk):
+                        return
+                    if not remaining:
+                        break
+                if remaining:
+                    raise SegmentError(f"segment {index} ended {remaining} bytes early")
+            except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError,
+                    SegmentError, OSError) as e:
+                attempts += 1
+                if attempts >= SEGMENT_ATTEMPTS or self._cancelled.is_set():
+                    self._put(q, e)
+                    return
+            except Exception as e:
+                # Hand anything unexpected to the reader instead of hanging it
+                self._put(q, e)
+                return
+            finally:
+                if resp is not None:
+                    resp.close()
+
+        self._put(q, _DONE)
+
+    def __iter__(self):
+        executor = ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix='segment')
+        submitted = 0
+        try:
+            for index in range(self.segments):
+                # Keep up to `connections` segments in flight ahead of the reader
+                while submitted < min(index + self.connections, self.segments):
+                    self._queues[submitted] = queue.Queue(self._queue_size)
+                    executor.submit(self._fetch_segment, submitted)
+                    submitted += 1
+
+                q = self._queues[index]
+                while True:
+                    item = q.get()
+                    if item is _DONE:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    self._track(-len(item))
+                    yield item
+                del self._queues[index]
+        finally:
+            self._cancelled.set()
+            executor.shutdown(wait=False)
+            self.first_response.close()
+            self._session.close()
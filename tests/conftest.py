@@ -0,0 +1,37 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+@pytest.fixture
+def serve_origin():
+    """
+    Start local HTTP/1.1 origins; serve_origin(handle) calls handle(request)
+    for every GET and returns the origin's base URL
+    """
+    servers = []
+
+    def start(handle):
+        class Origin(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                handle(self)
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f'http://127.0.0.1:{server.server_port}'
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,94 @@
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api'))
+
+import build_landing  # noqa: E402
+import index  # noqa: E402
+
+
+def call(query, method='GET', headers=None):
+    environ = {'REQUEST_METHOD': method, 'QUERY_STRING': query, 'PATH_INFO': '/',
+               'wsgi.input': io.BytesIO()}
+    for key, value in (headers or {}).items():
+        environ['HTTP_' + key.upper().replace('-', '_')] = value
+    started = {}
+
+    def start_response(status, headers):
+        started['status'] = status
+        started['headers'] = headers
+
+    body = b''.join(index.app(environ, start_response))
+    return started['status'], started['headers'], body
+
+
+@pytest.fixture
+def origin(serve_origin):
+    seen = []
+
+    def handle(request):
+        seen.append(dict(request.headers))
+        body = b'hello'
+        request.send_response(200)
+        request.send_header('Content-Length', str(len(body)))
+        if request.path.startswith('/cached'):
+            request.send_header('Cache-Control', 'max-age=60')
+        else:
+            request.send_header('Set-Cookie', 'a=1')
+            request.send_header('Set-Cookie', 'b=2')
+        request.end_headers()
+        request.wfile.write(body)
+
+    return serve_origin(handle), seen
+
+
+def test_landing_page():
+    status, headers, body = call('')
+    assert status == '200 OK'
+    assert b'<html' in body.lower()
+
+
+def test_prebuilt_landing_page_is_current():
+    # Edit HTML_TEMPLATE in proxy.py, then run `python build_landing.py`
+    with open(build_landing.LANDING_PATH, encoding='utf-8') as f:
+        assert build_landing.render_landing() == f.read()
+
+
+def test_proxied_request(origin):
+    url, seen = origin
+    status, headers, body = call(f'url={url}/page', headers={'User-Agent': 'test'})
+    assert (status, body) == ('200 OK', b'hello')
+    assert [v for k, v in headers if k == 'Set-Cookie'] == ['a=1', 'b=2']
+    assert not any(k.lower() == 'connection' for k, _ in headers)
+    assert seen[-1]['User-Agent'] == 'test'
+    # No Accept-Encoding from the client: the origin must not send gzip
+    assert seen[-1]['Accept-Encoding'] == 'identity'
+
+
+def test_client_accept_encoding_is_forwarded(origin):
+    url, seen = origin
+    call(f'url={url}/page', headers={'Accept-Encoding': 'br'})
+    assert seen[-1]['Accept-Encoding'] == 'br'
+
+
+def test_unsupported_method():
+    status, headers, body = call('url=http://example.com/', method='PATCH')
+    assert status.startswith('405')
+
+
+def test_cached_response(origin):
+    url, seen = origin
+    requests_before = len(seen)
+    first = call(f'url={url}/cached')
+    second = call(f'url={url}/cached')
+    assert first == second
+    assert first[0] == '200 OK'
+    assert len(seen) == requests_before + 1
+
+    # Responses that set cookies are never shared
+    call(f'url={url}/page')
+    call(f'url={url}/page')
+    assert len(seen) == requests_before + 3
@@ -0,0 +1,47 @@
+import pytest
+
+from cache import ResponseCache, cacheable_request, freshness
+
+
+@pytest.mark.parametrize('method, headers, expected', [
+    ('GET', {'Accept': '*/*'}, True),
+    ('POST', {}, False),
+    ('GET', {'Cookie': 'a=1'}, False),
+    ('GET', {'authorization': 'Bearer x'}, False),
+    ('GET', {'Range': 'bytes=0-1'}, False),
+])
+def test_cacheable_request(method, headers, expected):
+    assert cacheable_request(method, headers) is expected
+
+
+@pytest.mark.parametrize('headers, ttl', [
+    ({'Cache-Control': 'public, max-age=60'}, 60),
+    ({'Cache-Control': 's-maxage=30, max-age=10'}, 30),
+    ({'Cache-Control': 'max-age=86400'}, 300),
+    ({'Cache-Control': 'max-age=0'}, 0),
+    ({'Cache-Control': 'max-age=60, no-cache'}, 0),
+    ({'Cache-Control': 'max-age=60, private'}, 0),
+    ({'Cache-Control': 'no-store'}, 0),
+    ({'Cache-Control': 'max-age=soon'}, 0),
+    ({}, 0),
+    ({'Cache-Control': 'max-age=60', 'Set-Cookie': 'a=1'}, 0),
+    ({'Cache-Control': 'max-age=60', 'Vary': 'Accept-Encoding'}, 60),
+    ({'Cache-Control': 'max-age=60', 'Vary': 'Accept-Encoding, User-Agent'}, 0),
+])
+def test_freshness(headers, ttl):
+    assert freshness(headers, 300) == ttl
+
+
+def test_response_cache_limits():
+    cache = ResponseCache(max_entries=2, max_bytes=10, max_entry_bytes=6)
+    assert not cache.put('big', 200, {}, b'x' * 7, 60)
+    assert not cache.put('stale', 200, {}, b'x', 0)
+    assert cache.put('a', 200, {}, b'aaaa', 60)
+    assert cache.put('b', 200, {}, b'bbbb', 60)
+    cache.get('a')
+    # Over max_bytes: the least recently used entry goes
+    assert cache.put('c', 200, {}, b'cccc', 60)
+    assert 'b' not in cache
+    assert cache.get('a').body == b'aaaa'
+    assert cache.size_bytes == 8
+    assert (cache.hits, cache.misses) == (2, 0)
@@ -0,0 +1,88 @@
+import gzip
+import os
+import zlib
+
+import pytest
+
+import compression
+from compression import choose_encoding, compress_response, should_compress
+
+HTML = {'Content-Type': 'text/html; charset=utf-8'}
+PAGE = b'<p>Hello, streaming world</p>\n' * 40
+
+
+@pytest.fixture(autouse=True)
+def gzip_only(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', None)
+
+
+@pytest.mark.parametrize('accept_encoding, encoding', [
+    ('gzip, deflate', 'gzip'),
+    ('GZIP;q=0.5', 'gzip'),
+    ('gzip;q=0', None),
+    ('*', 'gzip'),
+    ('*, gzip;q=0', None),
+    ('deflate', None),
+    ('', None),
+    (None, None),
+])
+def test_choose_encoding(accept_encoding, encoding):
+    assert choose_encoding(accept_encoding) == encoding
+
+
+def test_choose_encoding_prefers_brotli(monkeypatch):
+    monkeypatch.setattr(compression, 'brotli', object())
+    assert choose_encoding('gzip, br') == 'br'
+    assert choose_encoding('gzip, br;q=0') == 'gzip'
+
+
+@pytest.mark.parametrize('method, status, headers, expected', [
+    ('GET', 200, HTML, True),
+    ('HEAD', 200, HTML, False),
+    ('GET', 206, HTML, False),
+    ('GET', 200, {'Content-Type': 'image/png'}, False),
+    ('GET', 200, dict(HTML, **{'Content-Encoding': 'gzip'}), False),
+    ('GET', 200, dict(HTML, **{'Cache-Control': 'public, no-transform'}), False),
+    ('GET', 200, dict(HTML, **{'Content-Length': '100'}), False),
+    ('GET', 200, dict(HTML, **{'Content-Length': '5000'}), True),
+])
+def test_should_compress(method, status, headers, expected):
+    assert should_compress(method, status, headers) is expected
+
+
+def test_headers_rewritten():
+    headers = dict(HTML, **{'Content-Length': str(len(PAGE)), 'ETag': '"v1"', 'Vary': 'Cookie'})
+    chunks, new_headers = compress_response('GET', 200, headers, 'gzip', [PAGE])
+    assert gzip.decompress(b''.join(chunks)) == PAGE
+    assert new_headers['Content-Encoding'] == 'gzip'
+    assert new_headers['Vary'] == 'Cookie, Accept-Encoding'
+    assert new_headers['ETag'] == 'W/"v1"'
+    assert 'Content-Length' not in new_headers
+
+
+def test_incompressible_body_passes_through():
+    body = os.urandom(4096)
+    chunks, headers = compress_response('GET', 200, HTML, 'gzip', [body])
+    assert b''.join(chunks) == body
+    assert headers is HTML
+
+
+def test_each_chunk_is_flushed():
+    # Every upstream chunk must be decodable on its own, before the body ends
+    pulled = []
+
+    def upstream():
+        for i in range(20):
+            pulled.append(i)
+            yield PAGE[:1024]
+
+    chunks, _ = compress_response('GET', 200, HTML, 'gzip', upstream())
+    # Deciding only needs the first chunk
+    assert pulled == [0]
+
+    decoder = zlib.decompressobj(31)
+    for i, chunk in enumerate(chunks):
+        assert decoder.decompress(chunk) == PAGE[:1024]
+        if i == 19:
+            break
+    assert pulled == list(range(20))
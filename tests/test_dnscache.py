@@ -0,0 +1,61 @@
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+
+from dnscache import DNSCache, DNSCachingAdapter
+
+
+def test_addresses_are_cached_and_deduplicated():
+    calls = []
+
+    def resolver(host, port, family, type):
+        calls.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.2', port))]
+
+    cache = DNSCache(ttl=60, resolver=resolver)
+    assert cache.addresses('example.com', 80) == ['10.0.0.1', '10.0.0.2']
+    assert cache.addresses('example.com', 80) == ['10.0.0.1', '10.0.0.2']
+    assert calls == ['example.com']
+
+    cache.ttl = 0
+    cache.addresses('example.org', 80)
+    cache.addresses('example.org', 80)
+    assert calls == ['example.com', 'example.org', 'example.org']
+
+
+def test_adapter_resolves_through_cache_only():
+    class Origin(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(204)
+            self.end_headers()
+
+    server = HTTPServer(('127.0.0.1', 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    resolved = []
+
+    def resolver(host, port, family, type):
+        resolved.append(host)
+        # An unreachable address first: the next one is tried
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.2', port)),
+                (socket.AF_INET, socket.SOCK_STREAM, 6, '', ('127.0.0.1', port))]
+
+    getaddrinfo = socket.getaddrinfo
+    session = requests.Session()
+    session.mount('http://', DNSCachingAdapter(DNSCache(resolver=resolver)))
+    try:
+        resp = session.get(f'http://origin.test:{server.server_port}/', timeout=5)
+        assert resp.status_code == 204
+        assert resolved == ['origin.test']
+        # The process-wide resolver is untouched
+        assert socket.getaddrinfo is getaddrinfo
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
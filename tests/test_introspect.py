@@ -0,0 +1,101 @@
+import threading
+import time
+import tracemalloc
+
+import pytest
+from flask import Flask
+
+from introspect import StreamRegistry, admin_blueprint, register_memory, sample_profile
+
+AUTH = {'Authorization': 'Bearer secret'}
+
+
+@pytest.fixture
+def client():
+    registry = StreamRegistry()
+    app = Flask(__name__)
+    app.register_blueprint(admin_blueprint(registry, 'secret'))
+    yield app.test_client(), registry
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def test_token_required(client):
+    client, _ = client
+    assert client.get('/_cybersplicer/streams').status_code == 403
+    assert client.get('/_cybersplicer/streams', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    # Query-string tokens would leak into access logs
+    assert client.get('/_cybersplicer/streams?token=secret').status_code == 403
+    assert client.get('/_cybersplicer/streams', headers=AUTH).status_code == 200
+
+
+def test_streams(client):
+    client, registry = client
+    info = registry.open('GET', 'https://example.com/', 'example.com')
+    info.bytes_sent = 10
+    info.buffered = lambda: 5
+    streams = client.get('/_cybersplicer/streams', headers=AUTH).get_json()
+    assert streams['count'] == 1
+    assert streams['streams'][0]['bytes_sent'] == 10
+    assert registry.buffered_bytes() == 5
+    registry.close(info)
+    assert len(registry) == 0
+
+
+def test_memory_probes(client):
+    client, _ = client
+    register_memory('test_probe', lambda: 123)
+    report = client.get('/_cybersplicer/memory', headers=AUTH).get_json()
+    assert report['subsystems']['test_probe'] == 123
+
+
+def test_tracemalloc_state_changes_need_post(client):
+    client, _ = client
+    assert client.get('/_cybersplicer/tracemalloc?action=start', headers=AUTH).status_code == 405
+    assert not tracemalloc.is_tracing()
+    assert client.post('/_cybersplicer/tracemalloc?action=start', headers=AUTH).status_code == 200
+    assert client.get('/_cybersplicer/tracemalloc?action=snapshot', headers=AUTH).get_json()['tracing']
+    assert client.get('/_cybersplicer/tracemalloc?action=stop', headers=AUTH).status_code == 405
+    assert client.post('/_cybersplicer/tracemalloc?action=stop', headers=AUTH).status_code == 200
+    assert not tracemalloc.is_tracing()
+
+
+def test_tracemalloc_rejects_bad_arguments(client):
+    client, _ = client
+    assert client.post('/_cybersplicer/tracemalloc?action=start&frames=0', headers=AUTH).status_code == 400
+    assert not tracemalloc.is_tracing()
+    assert client.post('/_cybersplicer/tracemalloc?action=start', headers=AUTH).status_code == 200
+    assert client.get('/_cybersplicer/tracemalloc?action=snapshot&key=bogus', headers=AUTH).status_code == 400
+    assert client.get('/_cybersplicer/tracemalloc?action=snapshot&key=filename', headers=AUTH).status_code == 200
+
+
+def test_sample_profile_collapsed_stacks():
+    lines = sample_profile(0.02, 0.005).splitlines()
+    for line in lines:
+        stack, count = line.rsplit(' ', 1)
+        assert int(count) > 0
+
+
+@pytest.mark.skipif(not hasattr(time, 'pthread_getcpuclockid'), reason='no per-thread CPU clocks')
+def test_sample_profile_skips_idle_threads():
+    stop = threading.Event()
+
+    def spin():
+        while not stop.is_set():
+            sum(range(1000))
+
+    def wait():
+        stop.wait()
+
+    threads = [threading.Thread(target=spin), threading.Thread(target=wait)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    try:
+        profile = sample_profile(0.3, 0.005)
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    assert 'spin (test_introspect.py' in profile
+    assert 'wait (test_introspect.py' not in profile
@@ -0,0 +1,72 @@
+import pytest
+
+from policy import PolicyEngine, build, parse_rule, split_url, url_path
+
+
+@pytest.mark.parametrize('line, rule', [
+    ('example.com', ('domain', 'example.com')),
+    ('0.0.0.0 ads.example.com  # tracker', ('domain', 'ads.example.com')),
+    ('*.Example.COM.', ('domain', 'example.com')),
+    ('||tracker.net^', ('domain', 'tracker.net')),
+    ('||tracker.net^$third-party', ('domain', 'tracker.net')),
+    ('||example.com/ads^', ('prefix', 'example.com/ads')),
+    ('example.com/ads/', ('prefix', 'example.com/ads')),
+    ('https://example.com:443/banner?x=1', ('prefix', 'example.com/banner')),
+    ('', None),
+    ('# comment', None),
+    ('! adblock comment', None),
+    ('[Adblock Plus 2.0]', None),
+    ('127.0.0.1 localhost', None),
+])
+def test_parse_rule(line, rule):
+    assert parse_rule(line) == rule
+
+
+@pytest.mark.parametrize('line', [
+    '@@||example.com^',
+    'example.com##.banner',
+    '/ads[0-9]+/',
+    '||example.com^*/ads/',
+    'bad host!.com',
+])
+def test_parse_rule_rejects_unsupported(line):
+    with pytest.raises(ValueError):
+        parse_rule(line)
+
+
+def test_build_and_match(tmp_path):
+    source = tmp_path / 'blocklist.txt'
+    source.write_text('\n'.join([
+        '0.0.0.0 tracker.net',
+        '||ads.example.org^$third-party',
+        'example.com/ads/',
+        '@@||good.tracker.net^',
+        'example.com##.banner',
+    ]))
+    output = tmp_path / 'rules.bin'
+    assert build([str(source)], str(output)) == (2, 1, 2)
+
+    engine = PolicyEngine(str(output))
+    assert engine.rule_count == 3
+    assert engine.match('https://cdn.tracker.net/x.js') == 'tracker.net'
+    assert engine.match('https://ads.example.org/') == 'ads.example.org'
+    assert engine.match('https://example.com/ads/banner.png') == 'example.com/ads'
+    assert engine.match('https://example.com/adsense') is None
+    assert engine.match('https://example.com/') is None
+    assert engine.match('https://nottracker.net/') is None
+    # Queries and fragments are not part of the path
+    assert engine.match('https://example.com?u=/ads/x') is None
+    assert engine.match('https://example.com/?u=/ads/x') is None
+    assert engine.match('https://user@Tracker.NET:8443?x') == 'tracker.net'
+
+
+@pytest.mark.parametrize('url, netloc, path', [
+    ('https://a.com/x/y?q=/z#f', 'a.com', '/x/y'),
+    ('https://a.com?u=/ads', 'a.com?u=', ''),
+    ('https://a.com#x/y', 'a.com#x', ''),
+    ('a.com/ads/x', 'a.com', '/ads/x'),
+    ('https://a.com', 'a.com', ''),
+])
+def test_split_url(url, netloc, path):
+    assert split_url(url)[0] == netloc
+    assert url_path(url) == path
@@ -0,0 +1,104 @@
+import time
+import urllib.parse
+
+import pytest
+
+from prefetch import (Prefetcher, SubresourceParser, normalize_url, page_charset,
+                      rewrite_subresources, subresource_url)
+
+PAGE = 'https://example.com/dir/page.html'
+
+
+def proxied(url):
+    return '/?url=' + urllib.parse.quote(url, safe='')
+
+
+@pytest.mark.parametrize('reference, url', [
+    ('style.css', 'https://example.com/dir/style.css'),
+    ('/a.js#frag', 'https://example.com/a.js'),
+    ('//cdn.example.net/x.png', 'https://cdn.example.net/x.png'),
+    ('data:image/png;base64,AAAA', None),
+    ('javascript:void(0)', None),
+    ('#top', None),
+    ('', None),
+    ('ftp://example.com/file', None),
+])
+def test_subresource_url(reference, url):
+    assert subresource_url(PAGE, reference) == url
+
+
+@pytest.mark.parametrize('content_type, charset', [
+    ('text/html', 'utf-8'),
+    ('text/html; charset="ISO-8859-1"', 'iso8859-1'),
+    ('text/html; charset=nonsense', 'utf-8'),
+])
+def test_page_charset(content_type, charset):
+    assert page_charset(content_type) == charset
+
+
+def test_parser_and_rewriter_agree():
+    html = (b'<html><head><link rel="stylesheet" href="/s.css?a=1&amp;b=2">'
+            b'<link rel=canonical href="/canonical">'
+            b'<script src=\'app.js\'></script></head>'
+            b'<body><img data-src="lazy.png" src="i.png"><a href="/next">next</a></body></html>')
+    parser = SubresourceParser(PAGE)
+    parser.feed(html.decode())
+    found = parser.take()
+    assert found == ['https://example.com/s.css?a=1&b=2', 'https://example.com/dir/app.js',
+                     'https://example.com/dir/i.png']
+
+    # Split the page at every position: tags cut between chunks are held back
+    for cut in range(1, len(html)):
+        out = b''.join(rewrite_subresources(PAGE, [html[:cut], html[cut:]])).decode()
+        for url in found:
+            assert f'"{proxied(url)}"' in out
+        assert 'href="/canonical"' in out
+        assert 'href="/next"' in out
+        assert 'data-src="lazy.png"' in out
+
+
+def test_rewrite_follows_base():
+    html = b'<base href="https://static.example.org/v2/"><img src="logo.png">'
+    out = b''.join(rewrite_subresources(PAGE, [html])).decode()
+    assert proxied('https://static.example.org/v2/logo.png') in out
+
+
+def test_rewritten_urls_match_prefetch_keys():
+    url = 'https://example.com/s.css?a=1&b=2'
+    query = urllib.parse.parse_qs(proxied(url)[2:])
+    assert normalize_url(query['url'][0]) == normalize_url(url)
+
+
+@pytest.fixture
+def origin(serve_origin):
+    def handle(request):
+        cache_control = {'/fresh': 'max-age=600', '/revalidate': 'max-age=600, no-cache',
+                         '/zero': 'max-age=0', '/vary': 'max-age=600'}.get(request.path, '')
+        request.send_response(200)
+        request.send_header('Content-Length', '2')
+        if cache_control:
+            request.send_header('Cache-Control', cache_control)
+        if request.path == '/vary':
+            request.send_header('Vary', 'User-Agent')
+        request.end_headers()
+        request.wfile.write(b'ok')
+
+    return serve_origin(handle)
+
+
+def test_only_shareable_responses_are_prefetched(origin):
+    prefetcher = Prefetcher(ttl=30, workers=2)
+    html = ''.join(f'<img src="{path}">' for path in ('/fresh', '/revalidate', '/zero', '/vary', '/plain'))
+    body = list(prefetcher.watch(origin + '/', 'text/html', {'Accept-Encoding': 'gzip'}, [html.encode()]))
+    assert body == [html.encode()]
+
+    deadline = time.monotonic() + 5
+    while prefetcher.stats['stored'] + prefetcher.stats['skipped'] < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert (prefetcher.stats['stored'], prefetcher.stats['skipped']) == (1, 4)
+
+    cached = prefetcher.lookup(normalize_url(origin + '/fresh'), 'gzip')
+    assert cached.body == b'ok'
+    # Stored for the response's lifetime, capped at the prefetch TTL
+    assert cached.expires - time.monotonic() <= 30
+    assert prefetcher.lookup(normalize_url(origin + '/fresh'), 'br') is None
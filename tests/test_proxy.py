@@ -0,0 +1,79 @@
+import os
+import socket
+import struct
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import pytest
+import requests
+
+PROXY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'proxy.py')
+AUTH = {'Authorization': 'Bearer secret'}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='module')
+def proxy():
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, PROXY, '--host', '127.0.0.1', '--port', str(port), '--admin-token', 'secret'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            requests.get(url + '/_cybersplicer/streams', headers=AUTH, timeout=1)
+            break
+        except requests.ConnectionError:
+            if time.monotonic() > deadline or process.poll() is not None:
+                process.kill()
+                pytest.fail("proxy did not start")
+            time.sleep(0.1)
+    yield url
+    process.terminate()
+    process.wait(5)
+
+
+def proxied(proxy, url):
+    return requests.get(proxy + '/?url=' + urllib.parse.quote(url, safe=''), timeout=10)
+
+
+def test_reset_before_first_chunk_returns_error_page(proxy, serve_origin):
+    def handle(request):
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/html')
+        request.send_header('Content-Length', '100000')
+        request.end_headers()
+        # Abort with a TCP reset before any of the body is sent
+        request.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+        request.connection.close()
+        request.close_connection = True
+
+    resp = proxied(proxy, serve_origin(handle) + '/page')
+    # The proxy's own error page, not Flask's bare 500
+    assert resp.status_code == 500
+    assert 'class="tagline" style="color: #e74c3c;">Error:' in resp.text
+    streams = requests.get(proxy + '/_cybersplicer/streams', headers=AUTH, timeout=5).json()
+    assert streams['count'] == 0
+
+
+def test_proxied_page(proxy, serve_origin):
+    def handle(request):
+        body = b'<p>' + b'hello ' * 200 + b'</p>'
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/html')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    resp = proxied(proxy, serve_origin(handle) + '/page')
+    assert resp.status_code == 200
+    assert resp.text.count('hello') == 200
+    assert resp.headers['Content-Encoding'] == 'gzip'
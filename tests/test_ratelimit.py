@@ -0,0 +1,102 @@
+import pytest
+
+import ratelimit
+from ratelimit import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, '_clock', lambda: now[0])
+    return now
+
+
+def test_request_bucket_refills(clock):
+    limiter = RateLimiter(requests_per_second=2, request_burst=2)
+    assert limiter.allow_request('a') == 0
+    assert limiter.allow_request('a') == 0
+    assert limiter.allow_request('a') == pytest.approx(0.5)
+    # Other keys have their own bucket
+    assert limiter.allow_request('b') == 0
+    clock[0] += 0.5
+    assert limiter.allow_request('a') == 0
+
+
+def test_bandwidth_debt(clock):
+    limiter = RateLimiter(bytes_per_second=1000)
+    assert limiter.consume_bytes('a', 1000) == 0
+    assert limiter.consume_bytes('a', 500) == pytest.approx(0.5)
+    clock[0] += 1.5
+    assert limiter.consume_bytes('a', 1000) == 0
+
+
+def test_update_returns_balances(clock):
+    limiter = RateLimiter(requests_per_second=1, bytes_per_second=100, request_burst=3, byte_burst=100)
+    assert limiter._update('a', 1, 40) == (True, 2.0, 60.0)
+    assert limiter._update('a', 5, 0) == (False, 2.0, 60.0)
+
+
+def test_disabled_limits(clock):
+    limiter = RateLimiter()
+    assert limiter.allow_request('a') == 0
+    assert limiter.consume_bytes('a', 10 ** 9) == 0
+
+
+def test_per_host_keys():
+    assert RateLimiter(per_host=True).key('1.2.3.4', 'example.com') == '1.2.3.4|example.com'
+    assert RateLimiter().key('1.2.3.4', 'example.com') == '1.2.3.4'
+
+
+def test_slots_must_be_power_of_two():
+    with pytest.raises(ValueError):
+        RateLimiter(slots=1000)
+
+
+def test_file_zeroed_on_resize(tmp_path, clock):
+    path = str(tmp_path / 'buckets')
+    limiter = RateLimiter(requests_per_second=1, slots=16, path=path)
+    limiter.allow_request('a')
+    assert any(bytes(limiter._table))
+
+    # Same size: the existing buckets are shared
+    assert any(bytes(RateLimiter(requests_per_second=1, slots=16, path=path)._table))
+    # A resize starts from an empty table
+    assert not any(bytes(RateLimiter(requests_per_second=1, slots=32, path=path)._table))
+
+
+def test_stamps_from_before_reboot_are_ignored(clock):
+    limiter = RateLimiter(requests_per_second=1, request_burst=1)
+    assert limiter.allow_request('a') == 0
+    assert limiter.allow_request('a') > 0
+
+    # After a reboot the monotonic clock restarts below the stored stamps
+    clock[0] = 5.0
+    assert limiter.allow_request('a') == 0
+
+
+def test_least_recently_used_slot_is_recycled(clock):
+    # Two slots: a single two-way set shared by every key
+    limiter = RateLimiter(requests_per_second=1, request_burst=1, slots=2)
+    assert limiter.allow_request('a') == 0
+    clock[0] += 0.1
+    assert limiter.allow_request('b') == 0
+    clock[0] += 0.1
+    # 'a' keeps coming back, so its empty bucket stays in the table
+    assert limiter.allow_request('a') > 0
+    clock[0] += 0.1
+    # The newcomer recycles 'b', the least recently used slot
+    assert limiter.allow_request('c') == 0
+    clock[0] += 0.1
+    assert limiter.allow_request('a') > 0
+    # 'b' lost its state and starts again with a full bucket
+    assert limiter.allow_request('b') == 0
+
+
+def test_more_keys_than_ways_evict_each_other(clock):
+    limiter = RateLimiter(requests_per_second=1, request_burst=1, slots=2)
+    # The accepted cost of a bounded table: three keys cycling through one
+    # set each find their slot recycled and always get a full bucket
+    for _ in range(3):
+        for key in 'abc':
+            clock[0] += 0.01
+            assert limiter.allow_request(key) == 0
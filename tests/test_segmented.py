@@ -0,0 +1,90 @@
+import queue
+import re
+
+import pytest
+import requests
+
+from segmented import SegmentedFetch, can_segment, validator
+
+BODY = bytes(range(256)) * 400
+
+
+def make_response(status=200, **headers):
+    resp = requests.Response()
+    resp.status_code = status
+    resp.headers.update({key.replace('_', '-'): value for key, value in headers.items()})
+    return resp
+
+
+RANGEABLE = {'Accept_Ranges': 'bytes', 'Content_Length': '100000', 'ETag': '"v1"'}
+
+
+def test_validator_prefers_strong_etag():
+    assert validator(make_response(ETag='"a"', Last_Modified='Mon')) == '"a"'
+    assert validator(make_response(ETag='W/"a"', Last_Modified='Mon')) == 'Mon'
+    assert validator(make_response()) is None
+
+
+@pytest.mark.parametrize('method, request_headers, status, headers, expected', [
+    ('GET', {}, 200, RANGEABLE, True),
+    ('HEAD', {}, 200, RANGEABLE, False),
+    ('GET', {'Range': 'bytes=0-10'}, 200, RANGEABLE, False),
+    ('GET', {}, 206, RANGEABLE, False),
+    ('GET', {}, 200, dict(RANGEABLE, Accept_Ranges='none'), False),
+    ('GET', {}, 200, dict(RANGEABLE, Content_Encoding='gzip'), False),
+    ('GET', {}, 200, dict(RANGEABLE, ETag='W/"v1"'), False),
+    ('GET', {}, 200, dict(RANGEABLE, Content_Length='99999'), False),
+    ('GET', {}, 200, dict(RANGEABLE, Content_Length='lots'), False),
+])
+def test_can_segment(method, request_headers, status, headers, expected):
+    resp = make_response(status, **headers)
+    assert can_segment(method, request_headers, resp, 100000) is expected
+
+
+@pytest.fixture
+def origin(serve_origin):
+    ranges = []
+
+    def handle(request):
+        start, end = 0, len(BODY) - 1
+        match = re.fullmatch(r'bytes=(\d+)-(\d+)', request.headers.get('Range', ''))
+        if match:
+            ranges.append((request.headers['Accept-Encoding'], request.headers['Range']))
+            start, end = int(match.group(1)), int(match.group(2))
+            request.send_response(206)
+            request.send_header('Content-Range', f'bytes {start}-{end}/{len(BODY)}')
+        else:
+            request.send_response(200)
+        request.send_header('Content-Length', str(end - start + 1))
+        request.send_header('Accept-Ranges', 'bytes')
+        request.send_header('ETag', '"v1"')
+        request.end_headers()
+        request.wfile.write(BODY[start:end + 1])
+
+    return serve_origin(handle) + '/file', ranges
+
+
+def test_segments_reassemble_in_order(origin):
+    url, ranges = origin
+    first = requests.get(url, stream=True)
+    fetch = SegmentedFetch(url, first, {'Accept-Encoding': 'gzip'}, connections=3,
+                           segment_size=16384, chunk_size=4096)
+    assert b''.join(fetch) == BODY
+    assert len(ranges) == fetch.segments - 1
+    assert all(encoding == 'identity' for encoding, _ in ranges)
+    assert fetch.buffered_bytes == 0
+
+
+def test_cancelled_segments_send_no_requests(origin):
+    url, ranges = origin
+    fetch = SegmentedFetch(url, requests.get(url, stream=True), segment_size=16384)
+    fetch._queues[2] = queue.Queue()
+    fetch._cancelled.set()
+    fetch._fetch_segment(2)
+    assert ranges == []
+    fetch.first_response.close()
+
+
+def test_segment_size_must_be_positive():
+    with pytest.raises(ValueError):
+        SegmentedFetch('http://example.com/', make_response(**RANGEABLE), segment_size=0)
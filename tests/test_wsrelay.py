@@ -0,0 +1,160 @@
+import socket
+import threading
+
+import pytest
+
+import wsrelay
+from wsrelay import UpgradedResponse, WebSocketRelay, is_upgrade, take_over
+
+
+class Limiter:
+    def __init__(self):
+        self.charged = []
+
+    def consume_bytes(self, key, size):
+        self.charged.append((key, size))
+        return 0
+
+
+def echo_upstream():
+    """
+    Listening socket that accepts one upgrade and echoes what follows
+    """
+    server = socket.create_server(('127.0.0.1', 0))
+
+    def serve():
+        conn, _ = server.accept()
+        with conn:
+            data = b''
+            while b'\r\n\r\n' not in data:
+                data += conn.recv(4096)
+            conn.sendall(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n'
+                         b'Connection: Upgrade\r\n\r\n')
+            while True:
+                data = conn.recv(4096)
+                if not data:
+                    break
+                conn.sendall(data)
+        server.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    return f"ws://127.0.0.1:{server.getsockname()[1]}/socket"
+
+
+def read_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        assert chunk
+        data += chunk
+    return data
+
+
+def test_is_upgrade():
+    assert is_upgrade({'Upgrade': 'websocket', 'Connection': 'keep-alive, Upgrade'})
+    assert not is_upgrade({'Upgrade': 'websocket', 'Connection': 'keep-alive'})
+    assert not is_upgrade({'Connection': 'Upgrade'})
+
+
+def test_take_over_leaves_server_socket_at_eof():
+    server_side, peer = socket.socketpair()
+    owned = take_over(server_side)
+    # What the server still holds reads end of stream and can be closed
+    assert server_side.recv(10) == b''
+    server_side.shutdown(socket.SHUT_WR)
+    server_side.close()
+    # The connection itself is untouched
+    peer.sendall(b'ping')
+    assert owned.recv(10) == b'ping'
+    owned.sendall(b'pong')
+    assert peer.recv(10) == b'pong'
+    owned.close()
+    peer.close()
+
+
+def test_relay_returns_after_handshake_and_charges_limit_key():
+    limiter = Limiter()
+    relay = WebSocketRelay(limiter=limiter)
+    closed = threading.Event()
+    server_side, browser = socket.socketpair()
+    browser.settimeout(5)
+
+    response = relay.handle({'werkzeug.socket': server_side}, echo_upstream(), {},
+                            '10.0.0.1', '10.0.0.1|example.com', on_close=closed.set)
+    assert isinstance(response, UpgradedResponse)
+    assert server_side.recv(10) == b''
+    assert relay._reserved == 1
+
+    head = b''
+    while b'\r\n\r\n' not in head:
+        head += browser.recv(4096)
+    assert head.startswith(b'HTTP/1.1 101')
+    browser.sendall(b'hello')
+    assert read_exactly(browser, 5) == b'hello'
+    assert limiter.charged == [('10.0.0.1|example.com', 5)]
+
+    browser.close()
+    assert closed.wait(5)
+    assert relay.report()['active'] == 0
+    assert relay._reserved == 0
+    assert relay._per_client == {}
+
+
+def test_per_client_limit_counts_addresses():
+    relay = WebSocketRelay(max_per_client=1)
+    relay._reserve('10.0.0.1')
+    closed = threading.Event()
+    response = relay.handle({'werkzeug.socket': object()}, 'ws://127.0.0.1:1/', {},
+                            '10.0.0.1', 'other-key', on_close=closed.set)
+    assert response.status_code == 429
+    assert closed.is_set()
+
+
+def test_unsupported_server():
+    relay = WebSocketRelay()
+    assert relay.handle({}, 'ws://127.0.0.1:1/', {}, '10.0.0.1').status_code == 501
+
+
+def test_unexpected_error_closes_only_that_connection(monkeypatch):
+    relay = WebSocketRelay()
+    conns = []
+    for _ in range(2):
+        a, b = socket.socketpair()
+        c, d = socket.socketpair()
+        relay._reserve('10.0.0.1')
+        conn = wsrelay._Connection(a, c, '10.0.0.1', '10.0.0.1', None)
+        relay._connections.add(conn)
+        conns.append((conn, b, d))
+
+    def broken(conn, now):
+        raise RuntimeError("bug")
+
+    monkeypatch.setattr(relay, '_update', broken)
+    relay._guarded(conns[0][0], relay._update, conns[0][0], 0.0)
+    assert conns[0][0] not in relay._connections
+    assert conns[1][0] in relay._connections
+    assert relay._per_client['10.0.0.1'] == 1
+    for conn, b, d in conns:
+        b.close()
+        d.close()
+        conn.client.close()
+        conn.upstream.close()
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_relay_thread_restarts_after_exit(monkeypatch):
+    relay = WebSocketRelay()
+
+    def stop(next_sweep):
+        raise SystemExit
+
+    monkeypatch.setattr(relay, '_run_once', stop)
+    thread = relay._thread = threading.Thread(target=relay._run)
+    thread.start()
+    thread.join(5)
+    assert relay._thread is None
+
+
+@pytest.fixture(autouse=True)
+def quiet_log(caplog):
+    caplog.set_level('CRITICAL', logger='web_proxy')
@@ -0,0 +1,493 @@
+"""
+WebSocket proxying for `?url=` requests that ask for `Upgrade: websocket`.
+
+The proxy opens a TCP (or TLS) connection to the target and forwards the
+client's handshake headers. It hands the upstream `101 Switching Protocols`
+reply back to the client unchanged. From then on the bytes on both sockets
+are already WebSocket frames, so they are relayed verbatim. One selector
+thread relays every connection with non-blocking sockets and bounded
+per-direction buffers, so an idle connection costs two sockets and a small
+record, and no thread. Connections are closed after an idle timeout.
+Downstream bytes are charged to the client's bandwidth bucket when a rate
+limiter is configured.
+
+The Werkzeug development server closes (and before that, tries to read the
+next request from) the client socket once the request handler returns. So
+after the handshake the relay keeps a duplicate of the connection's file
+descriptor and points the server's socket object at a closed socketpair:
+the server sees end of stream and frees its thread, while the connection
+itself lives on in the relay.
+"""
+
+import logging
+import os
+import selectors
+import socket
+import ssl
+import threading
+import time
+import urllib.parse
+from collections import Counter
+
+from flask import Response
+
+logger = logging.getLogger('web_proxy')
+
+HANDSHAKE_TIMEOUT = 10
+MAX_HANDSHAKE_BYTES = 16 * 1024
+READ_SIZE = 64 * 1024
+
+# Stop reading from one side while the other side has this much unsent
+MAX_PENDING = 256 * 1024
+
+# How often idle connections are swept, and how soon paused ones are resumed
+SWEEP_SECONDS = 1.0
+PAUSE_CHECK_SECONDS = 0.05
+
+# Client headers passed on in the upstream handshake
+FORWARDED_HEADERS = (
+    'Sec-WebSocket-Key', 'Sec-WebSocket-Version', 'Sec-WebSocket-Protocol',
+    'Sec-WebSocket-Extensions', 'Cookie', 'Authorization', 'User-Agent',
+    'Accept-Language', 'Pragma', 'Cache-Control',
+)
+
+
+class HandshakeError(Exception):
+    """
+    Raised when the target does not accept the WebSocket upgrade
+    """
+
+
+class UpgradedResponse(Response):
+    """
+    Response for a connection the relay has taken over
+
+    Raising ConnectionError makes the Werkzeug server treat the request as a
+    dropped connection instead of writing a second response onto the socket.
+    """
+
+    def __call__(self, environ, start_response):
+        raise ConnectionError("connection was upgraded to a WebSocket")
+
+
+def take_over(sock):
+    """
+    Move a server-owned connection to a new socket object the caller owns
+
+    The original object is left on a closed socketpair, so the server reads
+    end of stream from it and its shutdown() and close() do not touch the
+    connection.
+    """
+    fd = os.dup(sock.fileno())
+    try:
+        owned = socket.socket(fileno=fd)
+    except OSError:
+        os.close(fd)
+        raise
+    dead, peer = socket.socketpair()
+    peer.close()
+    try:
+        os.dup2(dead.fileno(), sock.fileno())
+    finally:
+        dead.close()
+    return owned
+
+
+def is_upgrade(headers):
+    """
+    Whether request headers ask for a WebSocket upgrade
+    """
+    return (headers.get('Upgrade', '').lower() == 'websocket'
+            and 'upgrade' in headers.get('Connection', '').lower())
+
+
+def open_upstream(url, request_headers):
+    """
+    Connect to a ws(s)/http(s) URL and perform the WebSocket handshake
+
+    Returns (socket, response head including the blank line, bytes already
+    received after the head).
+    """
+    parsed = urllib.parse.urlsplit(url)
+    secure = parsed.scheme in ('https', 'wss')
+    host = parsed.hostname
+    if not host:
+        raise HandshakeError(f"no host in {url}")
+    port = parsed.port or (443 if secure else 80)
+    netloc = host if parsed.port is None else f"{host}:{parsed.port}"
+    path = (parsed.path or '/') + (f"?{parsed.query}" if parsed.query else '')
+
+    sock = socket.create_connection((host, port), timeout=HANDSHAKE_TIMEOUT)
+    try:
+        if secure:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {netloc}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Origin: {'https' if secure else 'http'}://{netloc}",
+        ]
+        for name in FORWARDED_HEADERS:
+            value = request_headers.get(name)
+            if value:
+                lines.append(f"{name}: {value}")
+        sock.sendall(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+
+        data = b''
+        while b'\r\n\r\n' not in data:
+            chunk = sock.recv(4096)
+            if not chunk or len(data) > MAX_HANDSHAKE_BYTES:
+                raise HandshakeError("incomplete handshake response from upstream")
+            data += chunk
+        head, leftover = data.split(b'\r\n\r\n', 1)
+        status = head.split(b'\r\n', 1)[0].split(b' ', 2)
+        if len(status) < 2 or status[1] != b'101':
+            raise HandshakeError(f"upstream answered {b' '.join(status[1:]).decode('latin-1')}")
+        return sock, head + b'\r\n\r\n', leftover
+    except BaseException:
+        sock.close()
+        raise
+
+
+class _Connection:
+    """
+    One relayed client/upstream socket pair
+    """
+
+    __slots__ = ('client', 'upstream', 'client_ip', 'limit_key', 'stream', 'to_client', 'to_upstream',
+                 'on_close', 'bytes_up', 'bytes_down', 'last_active', 'paused_until', 'eof', 'interest')
+
+    def __init__(self, client, upstream, client_ip, limit_key, stream, on_close=None):
+        self.client = client
+        self.upstream = upstream
+        self.client_ip = client_ip
+        self.limit_key = limit_key
+        self.stream = stream
+        self.on_close = on_close
+        self.to_client = bytearray()
+        self.to_upstream = bytearray()
+        self.bytes_up = 0
+        self.bytes_down = 0
+        self.last_active = time.monotonic()
+        self.paused_until = 0.0
+        self.eof = False
+        self.interest = {}
+
+
+class WebSocketRelay:
+    """
+    Event-driven relay for all upgraded connections of this worker
+    """
+
+    def __init__(self, idle_timeout=300, max_connections=1000, max_per_client=50, limiter=None):
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.max_per_client = max_per_client
+        self.limiter = limiter
+        self.stats = {'accepted': 0, 'rejected': 0, 'failed': 0, 'closed_idle': 0,
+                      'bytes_up': 0, 'bytes_down': 0}
+        self._connections = set()
+        self._paused = set()
+        self._reserved = 0
+        self._per_client = Counter()
+        self._lock = threading.Lock()
+        self._incoming = []
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._thread = None
+
+    def report(self):
+        """
+        Connection and byte counters
+        """
+        stats = dict(self.stats)
+        stats['active'] = len(self._connections)
+        stats['buffered_bytes'] = self.buffered_bytes()
+        return stats
+
+    def buffered_bytes(self):
+        return sum(len(c.to_client) + len(c.to_upstream) for c in list(self._connections))
+
+    def _reserve(self, client_ip):
+        """
+        Count a new connection against the limits; return an error response or None
+        """
+        with self._lock:
+            if self._reserved >= self.max_connections:
+                self.stats['rejected'] += 1
+                return Response('Too many WebSocket connections', status=503)
+            if self._per_client[client_ip] >= self.max_per_client:
+                self.stats['rejected'] += 1
+                return Response('Too many WebSocket connections from this client', status=429)
+            self._reserved += 1
+            self._per_client[client_ip] += 1
+        return None
+
+    def _release(self, client_ip):
+        with self._lock:
+            self._reserved -= 1
+            self._per_client[client_ip] -= 1
+            if self._per_client[client_ip] <= 0:
+                del self._per_client[client_ip]
+
+    def handle(self, environ, url, request_headers, client_ip, limit_key=None, stream=None, on_close=None):
+        """
+        Proxy one upgrade request and take the connection over
+
+        client_ip is counted against the per-client connection limit;
+        downstream bytes are charged to limit_key (default: client_ip).
+        Returns once the handshake is done and the relay thread owns the
+        connection; on_close is called when the relay is finished with it,
+        or before returning if the upgrade failed.
+        """
+        conn = None
+        try:
+            conn = self._open(environ, url, request_headers, client_ip, limit_key, stream, on_close)
+        finally:
+            if conn is None and on_close is not None:
+                on_close()
+        if isinstance(conn, Response):
+            if on_close is not None:
+                on_close()
+            return conn
+
+        if stream is not None:
+            stream.phase = 'websocket'
+        with self._lock:
+            self.stats['accepted'] += 1
+            self._incoming.append(conn)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='websocket-relay', daemon=True)
+                self._thread.start()
+        self._wake_w.send(b'\0')
+        return UpgradedResponse()
+
+    def _open(self, environ, url, request_headers, client_ip, limit_key, stream, on_close):
+        """
+        Do the handshake; return a _Connection, or a Response on failure
+        """
+        client = environ.get('werkzeug.socket')
+        if client is None or isinstance(client, ssl.SSLSocket):
+            return Response('WebSocket upgrades are not supported by this server', status=501)
+
+        rejected = self._reserve(client_ip)
+        if rejected is not None:
+            return rejected
+
+        try:
+            upstream, head, leftover = open_upstream(url, request_headers)
+        except (OSError, HandshakeError) as e:
+            self._release(client_ip)
+            with self._lock:
+                self.stats['failed'] += 1
+            return Response(f'WebSocket handshake failed: {e}', status=502)
+
+        try:
+            client.sendall(head)
+            client = take_over(client)
+        except OSError:
+            upstream.close()
+            self._release(client_ip)
+            raise ConnectionError("client went away during the WebSocket handshake")
+
+        conn = _Connection(client, upstream, client_ip, limit_key or client_ip, stream, on_close)
+        conn.to_client += leftover
+        return conn
+
+    def _set_interest(self, conn, sock, events):
+        """
+        Register, modify or unregister a socket for the given selector events
+        """
+        current = conn.interest.get(sock, 0)
+        if events == current:
+            return
+        if not events:
+            self._selector.unregister(sock)
+        elif not current:
+            self._selector.register(sock, events, conn)
+        else:
+            self._selector.modify(sock, events, conn)
+        conn.interest[sock] = events
+
+    def _update(self, conn, now):
+        """
+        Recompute which directions of a connection can make progress
+        """
+        reading = not conn.eof
+        client_events = upstream_events = 0
+        if reading and len(conn.to_upstream) < MAX_PENDING:
+            client_events |= selectors.EVENT_READ
+        if reading and len(conn.to_client) < MAX_PENDING and conn.paused_until <= now:
+            upstream_events |= selectors.EVENT_READ
+        if conn.to_client:
+            client_events |= selectors.EVENT_WRITE
+        if conn.to_upstream:
+            upstream_events |= selectors.EVENT_WRITE
+        self._set_interest(conn, conn.client, client_events)
+        self._set_interest(conn, conn.upstream, upstream_events)
+
+    @staticmethod
+    def _recv(sock):
+        """
+        Read what is available; None if nothing yet, b'' at end of stream
+        """
+        try:
+            data = sock.recv(READ_SIZE)
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return None
+        if data and isinstance(sock, ssl.SSLSocket):
+            # Decrypted bytes left inside the SSL object never wake the selector
+            while sock.pending():
+                data += sock.recv(sock.pending())
+        return data
+
+    @staticmethod
+    def _send(sock, buffer):
+        try:
+            sent = sock.send(buffer)
+        except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            return
+        del buffer[:sent]
+
+    def _service(self, conn, sock, events, now):
+        """
+        Move bytes for one ready socket
+        """
+        from_client = sock is conn.client
+        if events & selectors.EVENT_READ:
+            data = self._recv(sock)
+            if data == b'':
+                conn.eof = True
+            elif data:
+                conn.last_active = now
+                if from_client:
+                    conn.to_upstream += data
+                    conn.bytes_up += len(data)
+                    self.stats['bytes_up'] += len(data)
+                else:
+                    conn.to_client += data
+                    conn.bytes_down += len(data)
+                    self.stats['bytes_down'] += len(data)
+                    if conn.stream is not None:
+                        conn.stream.bytes_sent += len(data)
+                    if self.limiter is not None:
+                        delay = self.limiter.consume_bytes(conn.limit_key, len(data))
+                        if delay:
+                            conn.paused_until = now + delay
+                            self._paused.add(conn)
+        if events & selectors.EVENT_WRITE:
+            self._send(sock, conn.to_upstream if sock is conn.upstream else conn.to_client)
+
+        if conn.eof and not conn.to_client and not conn.to_upstream:
+            self._close(conn)
+        else:
+            self._update(conn, now)
+
+    def _close(self, conn):
+        if conn not in self._connections:
+            return
+        self._connections.discard(conn)
+        self._paused.discard(conn)
+        for sock in (conn.client, conn.upstream):
+            if conn.interest.get(sock):
+                try:
+                    self._selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+            conn.interest[sock] = 0
+            sock.close()
+        self._release(conn.client_ip)
+        if conn.stream is not None:
+            conn.stream.phase = 'closed'
+        if conn.on_close is not None:
+            conn.on_close()
+
+    def _run(self):
+        """
+        Selector loop relaying every connection
+
+        An unexpected error closes only the connection it happened on; the
+        loop itself must keep running for all the others.
+        """
+        try:
+            next_sweep = time.monotonic() + SWEEP_SECONDS
+            while True:
+                next_sweep = self._run_once(next_sweep)
+        finally:
+            # Let the next upgrade start a fresh relay thread
+            with self._lock:
+                self._thread = None
+
+    def _run_once(self, next_sweep):
+        """
+        One round of the selector loop; returns the next sweep time
+        """
+        timeout = PAUSE_CHECK_SECONDS if self._paused else SWEEP_SECONDS
+        try:
+            ready = self._selector.select(timeout)
+        except Exception:
+            logger.exception("WebSocket relay: select failed")
+            time.sleep(timeout)
+            ready = []
+        for key, events in ready:
+            now = time.monotonic()
+            if key.data is None:
+                self._guarded(None, self._accept_incoming, now)
+                continue
+            conn = key.data
+            if conn in self._connections:
+                self._guarded(conn, self._service, conn, key.fileobj, events, now)
+
+        now = time.monotonic()
+        for conn in [c for c in self._paused if c.paused_until <= now]:
+            self._paused.discard(conn)
+            self._guarded(conn, self._update, conn, now)
+        if now >= next_sweep:
+            next_sweep = now + SWEEP_SECONDS
+            for conn in [c for c in self._connections if now - c.last_active > self.idle_timeout]:
+                self.stats['closed_idle'] += 1
+                self._guarded(conn, self._close, conn)
+        return next_sweep
+
+    def _guarded(self, conn, method, *args):
+        """
+        Call method; on failure close conn (if any) instead of ending the loop
+        """
+        try:
+            method(*args)
+        except OSError:
+            if conn is not None:
+                self._close_quietly(conn)
+        except Exception:
+            logger.exception("WebSocket relay error")
+            if conn is not None:
+                self._close_quietly(conn)
+
+    def _close_quietly(self, conn):
+        try:
+            self._close(conn)
+        except Exception:
+            logger.exception("WebSocket relay: closing a connection failed")
+
+    def _accept_incoming(self, now):
+        """
+        Start relaying connections handed over by request threads
+        """
+        try:
+            self._wake_r.recv(4096)
+        except BlockingIOError:
+            pass
+        with self._lock:
+            incoming, self._incoming = self._incoming, []
+        for conn in incoming:
+            self._connections.add(conn)
+            self._guarded(conn, self._start, conn, now)
+
+    def _start(self, conn, now):
+        conn.client.setblocking(False)
+        conn.upstream.setblocking(False)
+        self._update(conn, now)